@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+"""
+usage: apa_boards.py (--no-daemon) [command] [options]
+single entry point (apa-boards) for all the database scripts;
+each command takes the options of the script it runs, see apa_boards.py [command] --help
+only the module of the command that is run is imported,
+so listing the commands or asking for help does not load requests, qrcode, etc.
+If a daemon (apa_boards.py daemon) is running, commands are run inside it,
+reusing its authenticated session, unless --no-daemon is given;
+commands that run until interrupted (watch-position, daemon) are always run here.
+"""
+
+import sys
+
+# command -> (module, description)
+commands = {
+        'register-batch':('register_new_batch','Register a new batch and its boards'),
+        'register-board':('standalone_register_new_board','Register a single board in an existing batch'),
+        'upload-position':('upload_position_measurements','Upload position measurements from CMM csv files'),
+        'upload-thickness':('upload_thickness_measurements','Upload thickness measurements'),
+        'watch-position':('watch_position_measurements','Upload position measurements from a directory as they are written'),
+        'overwrite-position':('overwrite_position_measurement','Overwrite the position measurements of one board'),
+        'overwrite-thickness':('overwrite_thickness_measurement','Overwrite thickness measurements of one board'),
+        'export':('export_measurements','Export all batches and measurements to a local .npz snapshot'),
+        'label':('generate_label','Generate QR code labels'),
+        'uuid-cache':('uuid_cache','Inspect, export or clear the local UUID cache'),
+        'daemon':('apa_daemon','Keep an authenticated session warm for the other commands'),
+        }
+
+# never forwarded to the daemon, which runs one command at a time
+local_commands = {'watch-position','daemon'}
+
+prog = 'apa-boards'
+
+def usage(file=sys.stdout):
+    print(f"usage: {prog} (--no-daemon) [command] [options]\n\ncommands:",file=file)
+    for name, (module, description) in commands.items():
+        print(f"  {name:22s}{description}",file=file)
+    print(f"\nsee {prog} [command] --help for the options of each command",file=file)
+
+def main(argv=None):
+    import importlib
+    argv = sys.argv[1:] if argv is None else argv
+    use_daemon = True
+    if len(argv) > 0 and argv[0] == '--no-daemon':
+        use_daemon = False
+        argv = argv[1:]
+    if len(argv) == 0 or argv[0] in ('-h','--help'):
+        usage()
+        return
+    if argv[0] not in commands:
+        print(f"{prog}: unknown command '{argv[0]}'\n",file=sys.stderr)
+        usage(sys.stderr)
+        sys.exit(2)
+    if use_daemon and argv[0] not in local_commands:
+        from apa_daemon import forward
+        status = forward(argv)
+        if status is not None:
+            sys.exit(status)
+    module = importlib.import_module(commands[argv[0]][0])
+    module.main(argv[1:],prog=f"{prog} {argv[0]}")
+
+if __name__ == '__main__':
+    main()
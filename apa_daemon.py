@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+
+"""
+usage: apa_daemon.py (-p [port]) (--stop) [client options]
+long-lived local server that keeps one authenticated Sietch session warm
+(keep-alive connections, token, UUID cache and component cache);
+while it runs, apa_boards.py commands started from the same directory are
+run inside it instead of in a new process, with their output sent back.
+The client options (--retries, --component-ttl, --profile, ...) are given to the
+daemon when it is started; the same options given to a forwarded command are ignored.
+A command is aborted (as by Ctrl-C) when its client disconnects, e.g. on Ctrl-C.
+Only local connections carrying the key in .apa_daemon (next to config.dat,
+readable only by its owner) are accepted.
+Run apa_boards.py --no-daemon [command] to bypass a running daemon.
+"""
+
+import json
+import os
+import sys
+import traceback
+
+daemon_file_name = '.apa_daemon'
+
+def daemon_file(config_file='config.dat'):
+    return os.path.join(os.path.dirname(config_file),daemon_file_name)
+
+class Output:
+    """
+    file-like object sending everything written to it to the client
+    commands print from worker threads: lock is shared by every Output of a connection,
+    so their messages are not interleaved
+    """
+
+    def __init__(self, conn, stream, lock):
+        self.conn = conn
+        self.stream = stream
+        self.lock = lock
+
+    def write(self, s):
+        if s:
+            with self.lock:
+                try:
+                    self.conn.send((self.stream,s))
+                except OSError:
+                    # the client went away, the command is being aborted
+                    pass
+        return len(s)
+
+    def flush(self):
+        pass
+
+def abort(thread):
+    """
+    raise KeyboardInterrupt in thread, as Ctrl-C does in a command run outside the daemon
+    (it is raised once the thread runs python code again, e.g. when a pending request returns)
+    """
+    import ctypes
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(thread.ident),ctypes.py_object(KeyboardInterrupt))
+
+def run_command(conn, argv, cwd):
+    """
+    run an apa_boards.py command with its output sent over conn, followed by its exit status
+    the command runs in a thread, aborted if the client disconnects
+    """
+    import contextlib
+    import importlib
+    import threading
+    from apa_boards import commands, prog
+
+    status = [0]
+    lock = threading.Lock()
+
+    def run():
+        daemon_cwd = os.getcwd()
+        try:
+            os.chdir(cwd)
+            with contextlib.redirect_stdout(Output(conn,'stdout',lock)), contextlib.redirect_stderr(Output(conn,'stderr',lock)):
+                try:
+                    module = importlib.import_module(commands[argv[0]][0])
+                    module.main(argv[1:],prog=f"{prog} {argv[0]}")
+                except SystemExit as e:
+                    if isinstance(e.code,int):
+                        status[0] = e.code
+                    elif e.code is not None:
+                        print(e.code,file=sys.stderr)
+                        status[0] = 1
+                except KeyboardInterrupt:
+                    status[0] = 130
+                except Exception:
+                    traceback.print_exc()
+                    status[0] = 1
+        finally:
+            os.chdir(daemon_cwd)
+
+    thread = threading.Thread(target=run,daemon=True)
+    thread.start()
+    while thread.is_alive():
+        thread.join(0.1)
+        # clients send nothing while their command runs: something to read means they disconnected
+        if thread.is_alive() and conn.poll():
+            abort(thread)
+            thread.join()
+            return
+    with lock:
+        conn.send(('exit',status[0]))
+
+def serve(client, port=0, config_file='config.dat'):
+    """
+    run commands for thin clients (see forward) one at a time, sharing client, until stopped
+    """
+    from multiprocessing.connection import Listener
+    import sietch_client
+
+    sietch_client.shared_client = client
+    authkey = os.urandom(32)
+    filename = daemon_file(config_file)
+    with Listener(('127.0.0.1',port),authkey=authkey) as listener:
+        fd = os.open(filename,os.O_WRONLY|os.O_CREAT|os.O_TRUNC,0o600)
+        with os.fdopen(fd,'w') as fl:
+            json.dump({'port':listener.address[1],'authkey':authkey.hex()},fl)
+        print(f"Daemon listening on port {listener.address[1]}")
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except OSError:
+                    # includes failed authentication
+                    continue
+                with conn:
+                    try:
+                        message = conn.recv()
+                        if message[0] == 'ping':
+                            conn.send(('exit',0))
+                            continue
+                        if message[0] == 'stop':
+                            conn.send(('exit',0))
+                            break
+                        run_command(conn,*message[1:])
+                    except (EOFError,OSError):
+                        # client went away
+                        continue
+        finally:
+            os.remove(filename)
+
+def forward(argv, config_file='config.dat', message='run'):
+    """
+    run a command in the daemon, printing its output,
+    returns its exit status, or None if no daemon is running
+    """
+    from multiprocessing.connection import Client
+    try:
+        with open(daemon_file(config_file)) as fl:
+            info = json.load(fl)
+        conn = Client(('127.0.0.1',info['port']),authkey=bytes.fromhex(info['authkey']))
+    except (OSError,ValueError,KeyError):
+        return None
+    with conn:
+        conn.send((message,argv,os.getcwd()))
+        try:
+            while True:
+                kind, value = conn.recv()
+                if kind == 'exit':
+                    return value
+                stream = sys.stdout if kind == 'stdout' else sys.stderr
+                stream.write(value)
+                stream.flush()
+        except KeyboardInterrupt:
+            # closing the connection makes the daemon abort the command
+            print("Interrupted",file=sys.stderr)
+            return 130
+
+def main(argv=None, prog=None):
+    import argparse
+    from sietch_client import add_arguments, connect_from_args
+    parser = argparse.ArgumentParser(prog=prog)
+    parser.add_argument('-p','--port',help='Local port to listen on (default: any free port)',type=int,default=0)
+    parser.add_argument('--stop',help='Stop the running daemon',action='store_true')
+    parser.add_argument('-j','--jobs',help='Largest number of concurrent requests the commands will make',type=int,default=16)
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.stop:
+        if forward([],message='stop') is None:
+            print("No daemon is running",file=sys.stderr)
+            sys.exit(1)
+        return
+    if forward([],message='ping') is not None:
+        print("A daemon is already running",file=sys.stderr)
+        sys.exit(1)
+    client = connect_from_args(args,pool_size=args.jobs)
+    # authenticate now rather than on the first command
+    client.authenticate()
+    try:
+        serve(client,args.port)
+    finally:
+        client.close()
+
+if __name__ == '__main__':
+    main()
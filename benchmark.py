@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+"""
+usage: benchmark.py (-n [numbers of boards]) (-l [latency]) (-j [workers]) (--memory) (--startup) (--parse (--rows [rows])) (-o [output file] (--tag [tag]))
+End-to-end benchmark of the scripts against a local mock Sietch server.
+For each batch size, registers a batch, uploads position and thickness measurements,
+and generates labels, reporting wall time and round trips (and optionally peak memory) per step.
+With --startup, instead measures the time to start apa_boards.py and each of its commands
+(running them with --help, the best of several runs).
+With --parse, instead measures the rows per second of the position csv parser on a
+synthetic export (100k rows by default, 10 rows per board), against a baseline that
+calls strptime and converts each column separately for every row, as the parser used to.
+Results can be appended as json lines to a file, to track them from release to release.
+"""
+
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import mock_sietch_server
+
+def write_position_file(filename, batch, number):
+    with open(filename,'w') as fl:
+        fl.write('Name,BATCH_ID,BOARD_ID,Measurement time,1:Hole A X,1:Hole A Y,2:Hole B X,2:Hole B Y,2:Flatness\n')
+        fl.write(',,,,0.05,0.05,0.05,0.05,0.1\n')
+        for board in range(1,number+1):
+            values = ','.join(f'{random.gauss(0,0.02):.4f}' for i in range(5))
+            fl.write(f'Board,{batch},{board},05/13/2021 {board%12+1}:{board%60:02d}:00 PM,{values}\n')
+
+def write_thickness_files(dirname, labels, samples):
+    filenames = []
+    for label in labels:
+        filename = os.path.join(dirname,label+'.csv')
+        with open(filename,'w') as fl:
+            fl.writelines(f'{random.gauss(3.2,0.01):.4f}\n' for i in range(samples))
+        filenames.append(filename)
+    return filenames
+
+def measure(step, number, server, memory, function, *args, **kwargs):
+    before = sum(server.requests.values())
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        function(*args,**kwargs)
+    elapsed = time.perf_counter()-start
+    result = {
+            'step':step,
+            'boards':number,
+            'wallTime':elapsed,
+            'roundTrips':sum(server.requests.values())-before,
+            }
+    if memory:
+        result['peakMemory'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+def run(number, latency, jobs, memory=False):
+    import generate_label
+    import register_new_batch
+    import upload_position_measurements
+    import upload_thickness_measurements
+    from sietch_client import connect
+
+    batch = 1
+    results = []
+    server = mock_sietch_server.start(latency=latency)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            with open('config.dat','w') as conf_file:
+                json.dump({'url':server.url,'auth':{}},conf_file)
+
+            def client():
+                return connect(pool_size=max(2*jobs,10),use_cache=False)
+
+            results.append(measure('register_new_batch',number,server,memory,
+                register_new_batch.upload,batch,number,'HX',client=client(),jobs=jobs))
+
+            write_position_file('positions.csv',batch,number)
+            results.append(measure('upload_position_measurements',number,server,memory,
+                upload_position_measurements.upload,['positions.csv'],client=client(),jobs=jobs))
+
+            thickness_files = write_thickness_files(tmp,['left','right'],1000)
+            def upload_thickness(c):
+                for board in range(1,number+1):
+                    upload_thickness_measurements.upload(batch,board,thickness_files,client=c)
+            results.append(measure('upload_thickness_measurements',number,server,memory,upload_thickness,client()))
+
+            try:
+                import qrcode
+            except ImportError:
+                print("qrcode is not installed, skipping generate_label")
+            else:
+                results.append(measure('generate_label',number,server,memory,
+                    generate_label.upload_batch,batch,None,tmp,client=client()))
+        finally:
+            os.chdir(cwd)
+            server.shutdown()
+    return results
+
+def write_position_export(filename, rows, repeats=10):
+    """
+    a CMM export with rows rows, each board measured repeats times in a row
+    """
+    with open(filename,'w') as fl:
+        fl.write('Name,BATCH_ID,BOARD_ID,Measurement time,'+','.join(f'1:Hole {c} X,1:Hole {c} Y' for c in 'ABCDEF')+',2:Flatness\n')
+        fl.write(',,,,'+','.join(['0.05']*13)+'\n')
+        for i in range(rows):
+            board = i//repeats
+            values = ','.join(f'{random.gauss(0,0.02):.4f}' for j in range(13))
+            fl.write(f'Board,{board//1000+1},{board%1000+1},05/13/2021 {board%12+1}:{board%60:02d}:{board//60%60:02d} PM,{values}\n')
+
+def parse_baseline(filename):
+    import csv
+    import datetime
+    from position_csv import PositionHeader, time_format
+    with open(filename) as fl:
+        header = None
+        for row in csv.reader(fl):
+            if header is None:
+                header = PositionHeader(row)
+                continue
+            if len(row[header.pos_batch]) == 0:
+                continue
+            values = {key:float(row[pos]) for pos,key in header.columns if pos < len(row)}
+            time = str(datetime.datetime.strptime(row[header.pos_time],time_format))
+
+def parse_current(filename):
+    from position_csv import read_rows, parse_time
+    for batch, board, time, values in read_rows(filename):
+        time = parse_time(time)
+
+def parse_indexed(filename):
+    from position_csv import RowIndex, parse_time
+    for batch, board, time, values in RowIndex(filename).rows():
+        time = parse_time(time)
+
+def parse(rows):
+    """
+    rows per second of each way of parsing a synthetic export with a time conversion per row
+    """
+    from position_csv import parse_time
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp,'positions.csv')
+        write_position_export(filename,rows)
+        for step, function in [('parse baseline (strptime)',parse_baseline),('parse read_rows',parse_current),('parse RowIndex.rows',parse_indexed)]:
+            parse_time.cache_clear()
+            start = time.perf_counter()
+            function(filename)
+            elapsed = time.perf_counter()-start
+            results.append({'step':step,'rows':rows,'wallTime':elapsed,'rowsPerSecond':rows/elapsed})
+    return results
+
+def startup(repeat=5):
+    """
+    best wall time of starting apa_boards.py with no command and with each command's --help
+    """
+    import apa_boards
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),'apa_boards.py')
+    results = []
+    for command in [None]+list(apa_boards.commands):
+        argv = ['--help'] if command is None else [command,'--help']
+        times = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable,script]+argv,stdout=subprocess.DEVNULL,check=True)
+            times.append(time.perf_counter()-start)
+        results.append({'step':'startup '+(command or 'apa-boards'),'wallTime':min(times)})
+    return results
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n','--number',help='Numbers of boards per batch',type=int,nargs='+',default=[10,100,1000])
+    parser.add_argument('-l','--latency',help='Mock server delay per request, in seconds',type=float,default=0.005)
+    parser.add_argument('-j','--jobs',help='Number of concurrent workers passed to the scripts',type=int,default=8)
+    parser.add_argument('--memory',help='Also record peak python memory (slows the run down)',action='store_true')
+    parser.add_argument('--startup',help='Measure the start up time of each command instead',action='store_true')
+    parser.add_argument('--parse',help='Measure the position csv parser instead',action='store_true')
+    parser.add_argument('--rows',help='Number of rows in the synthetic export for --parse',type=int,default=100000)
+    parser.add_argument('-o','--output',help='Append results as json lines to this file')
+    parser.add_argument('--tag',help='Release tag recorded with the results in the output file',default='')
+    args = parser.parse_args()
+
+    if args.parse:
+        print(f"{'step':32s} {'rows':>7s} {'wall time [s]':>14s} {'rows/s':>10s}")
+        for result in parse(args.rows):
+            print(f"{result['step']:32s} {result['rows']:7d} {result['wallTime']:14.3f} {result['rowsPerSecond']:10.0f}")
+            if args.output:
+                with open(args.output,'a') as fl:
+                    fl.write(json.dumps(dict(tag=args.tag,**result))+'\n')
+        return
+
+    if args.startup:
+        print(f"{'step':32s} {'wall time [s]':>14s}")
+        for result in startup():
+            print(f"{result['step']:32s} {result['wallTime']:14.3f}")
+            if args.output:
+                with open(args.output,'a') as fl:
+                    fl.write(json.dumps(dict(tag=args.tag,**result))+'\n')
+        return
+
+    print(f"{'step':32s} {'boards':>7s} {'wall time [s]':>14s} {'round trips':>12s} {'peak memory [MB]':>17s}")
+    for number in args.number:
+        for result in run(number,args.latency,args.jobs,args.memory):
+            peak = f"{result['peakMemory']/1e6:.1f}" if 'peakMemory' in result else '-'
+            print(f"{result['step']:32s} {result['boards']:7d} {result['wallTime']:14.3f} {result['roundTrips']:12d} {peak:>17s}")
+            if args.output:
+                with open(args.output,'a') as fl:
+                    fl.write(json.dumps(dict(tag=args.tag,latency=args.latency,jobs=args.jobs,**result))+'\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Resolve board UUIDs in bulk: one search per batch instead of one per board.
+Lookups return {(batchId, boardId): [componentUuid, ...]}, so the
+zero/multiple match checks can be done locally.
+Results are answered from, and saved to, the client's local UUID cache.
+find_batch does the same for a batch, with its board type and number of boards.
+"""
+
+import threading
+
+from sietch_config import batch_component_name, board_component_name
+
+def search_batch_components(client, batch):
+    """
+    all board components of a batch (as returned by the search, with their data),
+    their UUIDs are saved to the cache
+    """
+    results = client.search(board_component_name,{'data.batchId':batch})
+    if client.uuid_cache is not None:
+        index = {}
+        for result in results:
+            index.setdefault((batch,result['data']['boardId']),[]).append(result['componentUuid'])
+        client.uuid_cache.update(index)
+    return results
+
+def search_batch(client, batch):
+    index = {}
+    for result in search_batch_components(client,batch):
+        board = result['data']['boardId']
+        index.setdefault((batch,board),[]).append(result['componentUuid'])
+    return index
+
+def search_batches(client, batches):
+    index = {}
+    for batch in batches:
+        index.update(search_batch(client,batch))
+    return index
+
+def resolve_boards(client, boards):
+    """
+    Index for a list of (batch, board) pairs; only batches with a board
+    missing from the cache are searched
+    """
+    index = {}
+    missing_batches = set()
+    for batch, board in boards:
+        uuid = client.uuid_cache.get(batch,board) if client.uuid_cache is not None else None
+        if uuid is None:
+            missing_batches.add(batch)
+        else:
+            index[(batch,board)] = [uuid]
+    found = search_batches(client,missing_batches)
+    for batch, board in boards:
+        if batch in missing_batches:
+            index[(batch,board)] = found.get((batch,board),[])
+    return index
+
+def find_board(client, batch, board):
+    """
+    UUID of a single board, raises if the board is missing or duplicated
+    """
+    if client.uuid_cache is not None:
+        uuid = client.uuid_cache.get(batch,board)
+        if uuid is not None:
+            return uuid
+
+    payload={
+        'data.batchId':batch,
+        'data.boardId':board,
+        }
+
+    results = client.search(board_component_name,payload)
+
+    if len(results) == 0:
+        raise Exception("No board found with this batch/board number!")
+    if len(results) > 1:
+        raise Exception("Multiple boards exist with this batch/board number!")
+
+    uuid = results.pop()['componentUuid']
+    if client.uuid_cache is not None:
+        client.uuid_cache.put(batch,board,uuid)
+    return uuid
+
+class BoardResolver:
+    """
+    Thread-safe lazy lookups: the first cache miss in a batch submits one
+    search for the whole batch to pool, later lookups in that batch share it
+    """
+
+    def __init__(self, client, pool):
+        self.client = client
+        self.pool = pool
+        self.lock = threading.Lock()
+        self.batches = {}
+
+    def lookup(self, batch, board):
+        if self.client.uuid_cache is not None:
+            uuid = self.client.uuid_cache.get(batch,board)
+            if uuid is not None:
+                return [uuid]
+        with self.lock:
+            if batch not in self.batches:
+                self.batches[batch] = self.pool.submit(search_batch,self.client,batch)
+            future = self.batches[batch]
+        return future.result().get((batch,board),[])
+
+def find_batch(client, batch):
+    """
+    (uuid, board type, number of boards) of a registered batch, from the local cache
+    if it is there, otherwise from the database (and then cached)
+    raises if the batch has not been registered
+    """
+    if client.uuid_cache is not None:
+        info = client.uuid_cache.get_batch(batch)
+        if info is not None:
+            return info
+
+    results = client.search(batch_component_name,{'data.batchId':batch})
+
+    if len(results) != 1:
+        raise Exception("This batch has not been registered!")
+
+    batch_uuid = results.pop()['componentUuid']
+    data = client.get_component(batch_uuid)['data']
+    info = (batch_uuid,data['boardType'],data.get('number'))
+    if client.uuid_cache is not None:
+        client.uuid_cache.put_batch(batch,*info)
+    return info
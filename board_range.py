@@ -0,0 +1,19 @@
+import argparse
+
+def parse_board_range(s):
+    """
+    '3,7,12-40' -> [3, 7, 12, 13, ..., 40]
+    board numbers start at 1, and a range must not be reversed
+    """
+    boards = []
+    for part in s.split(','):
+        if '-' in part:
+            first, last = (int(i) for i in part.split('-'))
+            if first > last:
+                raise argparse.ArgumentTypeError(f"reversed board range {part}")
+            boards.extend(range(first,last+1))
+        else:
+            boards.append(int(part))
+    if any(board < 1 for board in boards):
+        raise argparse.ArgumentTypeError(f"board numbers start at 1: {s}")
+    return boards
@@ -28,3 +28,25 @@ types={
         'EG3':'edgeGType3',
         'EG4':'edgeGType4',
         }
+
+# EX1, EX2 and EX3 all map to edgeXType1; boards already registered carry that
+# name, so the mapping is kept as it is
+
+# canonical name -> codes, in the order above
+codes = {}
+for code, name in types.items():
+    codes.setdefault(name,[]).append(code)
+
+def board_type(code):
+    """
+    canonical name of a board type code
+    """
+    if code not in types:
+        raise Exception(f"Unknown board type '{code}', expected one of {', '.join(types)}")
+    return types[code]
+
+def board_codes(name):
+    """
+    codes of a canonical board type name
+    """
+    return codes.get(name,[])
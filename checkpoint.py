@@ -0,0 +1,58 @@
+"""
+Append-only local journal of finished work items (e.g. registered boards),
+so an interrupted run can resume at the first unfinished item.
+Journals live in a checkpoints directory next to config.dat and are
+removed once a run completes without failures.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+checkpoint_dir_name = 'checkpoints'
+
+class Journal:
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.done = set()
+        if os.path.exists(filename):
+            with open(filename) as fl:
+                for line in fl:
+                    line = line.strip()
+                    if line:
+                        self.done.add(tuple(json.loads(line)))
+        self.resumed = len(self.done) > 0
+        self.fl = open(filename,'a')
+
+    def __contains__(self, item):
+        with self.lock:
+            return tuple(item) in self.done
+
+    def add(self, item):
+        item = tuple(item)
+        with self.lock:
+            self.done.add(item)
+            self.fl.write(json.dumps(item)+'\n')
+            self.fl.flush()
+
+    def close(self):
+        self.fl.close()
+
+    def remove(self):
+        self.close()
+        os.remove(self.filename)
+
+def open_journal(name, config_file='config.dat'):
+    dirname = os.path.join(os.path.dirname(config_file),checkpoint_dir_name)
+    os.makedirs(dirname,exist_ok=True)
+    return Journal(os.path.join(dirname,name+'.journal'))
+
+def files_key(filenames):
+    """
+    short stable name for a set of input files
+    """
+    paths = sorted(os.path.abspath(f) for f in filenames)
+    return hashlib.sha1('\n'.join(paths).encode()).hexdigest()[:12]
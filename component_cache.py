@@ -0,0 +1,49 @@
+"""
+In-memory LRU cache of component documents with a time-to-live.
+Entries younger than ttl are used as they are; older entries are
+revalidated with the server using their ETag / Last-Modified.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+class CacheEntry:
+
+    def __init__(self, document, etag=None, last_modified=None):
+        self.document = document
+        self.etag = etag
+        self.last_modified = last_modified
+        self.time = time.monotonic()
+
+class ComponentCache:
+
+    def __init__(self, max_entries=256, ttl=0.):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, uuid):
+        with self.lock:
+            entry = self.entries.get(uuid)
+            if entry is not None:
+                self.entries.move_to_end(uuid)
+            return entry
+
+    def put(self, uuid, document, etag=None, last_modified=None):
+        with self.lock:
+            self.entries[uuid] = CacheEntry(document,etag,last_modified)
+            self.entries.move_to_end(uuid)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def forget(self, uuid):
+        with self.lock:
+            self.entries.pop(uuid,None)
+
+    def is_fresh(self, entry):
+        return time.monotonic()-entry.time < self.ttl
+
+    def refresh(self, entry):
+        entry.time = time.monotonic()
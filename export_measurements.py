@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+"""
+usage: export_measurements.py (-o [snapshot.npz]) (-j [workers]) (--full)
+export every batch and board, with their QC measurements, to a local numpy .npz snapshot
+for analysis without the database
+batches are listed with one search, then the boards of every batch are fetched
+concurrently with one search per batch (the search returns the whole components)
+a later export only searches the batches that were not complete in the snapshot
+(complete: all boards registered, each with position and thickness measurements),
+unless --full is given; complete batches whose boards all have an ETag in the snapshot
+(search results carry none, they come from earlier revalidations) are revalidated with
+one conditional GET per board (If-None-Match, so unchanged boards are not downloaded again),
+the other complete batches are searched again, as are all of them if the server sends no ETags
+the snapshot holds flat arrays, one entry per batch (batch_*), per board (board_* and
+one array per position* key, NaN where not measured) and per thickness measurement
+(thickness_*, whose samples are thickness_samples[start:start+length]);
+load it with load_snapshot, e.g.
+    s = load_snapshot('snapshot.npz')
+    s['positionHoleAX'][s['board_batch'] == 7]
+"""
+
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from sietch_client import connect, add_arguments, connect_from_args
+from sietch_config import batch_component_name
+from board_index import search_batch_components
+
+position_key = 'qcPositionMeasurements'
+thickness_key = 'qcThicknessMeasurements'
+
+def board_record(component, etag=''):
+    """
+    the fields of a board component kept in the snapshot, etag is its version if known
+    """
+    data = component['data']
+    positions = data.get(position_key) or {}
+    return {
+            'batch':data['batchId'],
+            'board':data['boardId'],
+            'uuid':component['componentUuid'],
+            'etag':etag,
+            'type':data.get('boardType',''),
+            'status':data.get('boardStatus',''),
+            'time':positions.get('measurementTime',''),
+            'positions':{k:v for k,v in positions.items() if k.startswith('position')},
+            'thickness':{m['measurementLabel']:m['measurement'] for m in data.get(thickness_key) or []},
+            }
+
+def batch_complete(batch, boards):
+    return len(boards) == batch['number'] and all(len(b['time']) > 0 and len(b['thickness']) > 0 for b in boards)
+
+def revalidate(client, record):
+    """
+    the up to date record of a board, reusing record if the server confirms it is unchanged (304)
+    None if the server sends no ETag for it
+    """
+    headers = {'if-none-match':record['etag']} if record['etag'] else {}
+    r = client.request('GET','/api/component/'+record['uuid'],headers=headers)
+    etag = r.headers.get('etag')
+    if etag is None:
+        return None
+    if r.status_code == 304:
+        return record
+    return board_record(dict(r.json(),componentUuid=record['uuid']),etag)
+
+def load_snapshot(filename):
+    """
+    {array name: numpy array} of a snapshot
+    """
+    with np.load(filename) as snapshot:
+        return {k:snapshot[k] for k in snapshot.files}
+
+def records_from_snapshot(snapshot):
+    """
+    ({batchId: batch}, {batchId: [board records]}) back from a snapshot
+    """
+    batches = {}
+    for batch, number, board_type in zip(snapshot['batch_id'],snapshot['batch_number'],snapshot['batch_type']):
+        batches[int(batch)] = {'batch':int(batch),'number':int(number),'type':str(board_type)}
+    position_columns = [k for k in snapshot if k.startswith('position')]
+    boards = {}
+    # snapshots written before ETags were kept have no board_etag
+    etags = snapshot.get('board_etag',np.full(len(snapshot['board_batch']),''))
+    for i in range(len(snapshot['board_batch'])):
+        time = snapshot['board_time'][i]
+        boards.setdefault(int(snapshot['board_batch'][i]),[]).append({
+            'batch':int(snapshot['board_batch'][i]),
+            'board':int(snapshot['board_id'][i]),
+            'uuid':str(snapshot['board_uuid'][i]),
+            'etag':str(etags[i]),
+            'type':str(snapshot['board_type'][i]),
+            'status':str(snapshot['board_status'][i]),
+            'time':'' if np.isnat(time) else str(time).replace('T',' '),
+            'positions':{k:float(snapshot[k][i]) for k in position_columns if not np.isnan(snapshot[k][i])},
+            'thickness':{},
+            })
+    index = {(b['batch'],b['board']):b for batch_boards in boards.values() for b in batch_boards}
+    for batch, board, label, start, length in zip(snapshot['thickness_batch'],snapshot['thickness_board'],snapshot['thickness_label'],
+            snapshot['thickness_start'],snapshot['thickness_length']):
+        index[(int(batch),int(board))]['thickness'][str(label)] = snapshot['thickness_samples'][start:start+length]
+    return batches, boards
+
+def flatten(batches, boards):
+    """
+    snapshot arrays from ({batchId: batch}, {batchId: [board records]})
+    """
+    board_list = sorted((b for batch_boards in boards.values() for b in batch_boards),key=lambda b: (b['batch'],b['board']))
+    arrays = {
+            'batch_id':np.array(sorted(batches),dtype=np.int64),
+            'batch_number':np.array([batches[b]['number'] for b in sorted(batches)],dtype=np.int64),
+            'batch_type':np.array([batches[b]['type'] for b in sorted(batches)],dtype=str),
+            'board_batch':np.array([b['batch'] for b in board_list],dtype=np.int64),
+            'board_id':np.array([b['board'] for b in board_list],dtype=np.int64),
+            'board_uuid':np.array([b['uuid'] for b in board_list],dtype=str),
+            'board_etag':np.array([b['etag'] for b in board_list],dtype=str),
+            'board_type':np.array([b['type'] for b in board_list],dtype=str),
+            'board_status':np.array([b['status'] for b in board_list],dtype=str),
+            'board_time':np.array([b['time'] or 'NaT' for b in board_list],dtype='datetime64[s]'),
+            }
+    position_columns = sorted({k for b in board_list for k in b['positions']})
+    for k in position_columns:
+        arrays[k] = np.array([b['positions'].get(k,np.nan) for b in board_list],dtype=np.float64)
+
+    thickness = [(b['batch'],b['board'],label,np.asarray(samples,dtype=np.float64))
+            for b in board_list for label,samples in sorted(b['thickness'].items())]
+    lengths = np.array([len(t[3]) for t in thickness],dtype=np.int64)
+    arrays.update({
+            'thickness_batch':np.array([t[0] for t in thickness],dtype=np.int64),
+            'thickness_board':np.array([t[1] for t in thickness],dtype=np.int64),
+            'thickness_label':np.array([t[2] for t in thickness],dtype=str),
+            'thickness_start':np.cumsum(lengths)-lengths,
+            'thickness_length':lengths,
+            'thickness_samples':np.concatenate([t[3] for t in thickness]) if len(thickness) > 0 else np.zeros(0),
+            })
+    return arrays
+
+def export(filename, client=None, jobs=8, full=False):
+
+    if client is None:
+        client = connect(pool_size=max(jobs,10))
+
+    batches = {}
+    for component in client.search(batch_component_name,{}):
+        data = component['data']
+        batches[data['batchId']] = {'batch':data['batchId'],'number':data.get('number',0),'type':data.get('boardType','')}
+
+    boards = {}
+    complete = {}
+    if not full:
+        try:
+            previous_batches, previous_boards = records_from_snapshot(load_snapshot(filename))
+        except FileNotFoundError:
+            previous_batches, previous_boards = {}, {}
+        for batch in batches:
+            if batch in previous_batches and batch_complete(batches[batch],previous_boards.get(batch,[])) \
+                    and all(b['etag'] for b in previous_boards[batch]):
+                complete[batch] = previous_boards[batch]
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        previous = [record for batch in sorted(complete) for record in complete[batch]]
+        # one board first, not to GET every board of a server that sends no ETags
+        first = revalidate(client,previous[0]) if len(previous) > 0 else None
+        if first is not None:
+            print(f"Revalidating {len(previous)} boards of {len(complete)} complete batches",file=sys.stderr)
+            records = [first]+list(pool.map(lambda record: revalidate(client,record),previous[1:]))
+            for old, record in zip(previous,records):
+                boards.setdefault(old['batch'],[]).append(record)
+        for batch in list(boards):
+            if None in boards[batch]:
+                boards.pop(batch)
+
+        to_fetch = [batch for batch in sorted(batches) if batch not in boards]
+        print(f"Fetching {len(to_fetch)} of {len(batches)} batches",file=sys.stderr)
+        for batch, components in zip(to_fetch,pool.map(lambda batch: search_batch_components(client,batch),to_fetch)):
+            boards[batch] = [board_record(c) for c in components]
+
+    arrays = flatten(batches,boards)
+    np.savez_compressed(filename,**arrays)
+    print(f"Exported {len(batches)} batches, {len(arrays['board_id'])} boards and {len(arrays['thickness_label'])} thickness measurements to {filename}")
+
+
+def main(argv=None, prog=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog=prog)
+    parser.add_argument('-o','--output',help='Snapshot file',default='snapshot.npz')
+    parser.add_argument('-j','--jobs',help='Number of batches to fetch concurrently',type=int,default=8)
+    parser.add_argument('--full',help='Search every batch again, instead of revalidating the boards of those complete in the snapshot',action='store_true')
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    export(args.output,client=connect_from_args(args,pool_size=max(args.jobs,10)),jobs=args.jobs,full=args.full)
+
+if __name__ == '__main__':
+    main()
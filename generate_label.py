@@ -1,69 +1,180 @@
 #!/usr/bin/env python
 
 """
-usage: generate_label.py -B [batch] -b [board] (-d [directory])
+usage: generate_label.py -B [batch] (-b [board(s)] | --all) (-d [directory]) (-j [processes]) (--sheet)
 generate label (qr code) for board, as svg file
 Optionally place svg file in directory (default current directory)
+Boards may be given as a list/range (e.g. 3,7,12-40), or --all for every board in the batch;
+their UUIDs are then resolved with one search and the labels rendered in parallel.
+With --sheet, all labels are also placed on a single svg sheet.
+With --manifest (a csv file of batchId,boardId,componentUuid, see uuid_cache.py --export)
+or --offline (the local UUID cache) no network access is needed at all.
 """
 
-import json
-import requests
+import re
+import sys
 
-from sietch_config import board_component_name
-
-def upload(batch, board, dir):
-
-    with open('config.dat') as conf_file:
-        config = json.load(conf_file)
-        baseurl = config['url']
-
-    header = { 'content-type': 'application/json' }
-
-    r = requests.post(baseurl+'/machineAuthenticate',json=config['auth'],headers=header)
-    if not r:
-        raise Exception(r.text)
-
-    token=r.text
-
-    header['authorization']='Bearer '+token
-
-    payload={
-        'data.batchId':batch,
-        'data.boardId':board,
-        }
-
-    r = requests.post(baseurl+'/api/search/component/'+board_component_name,json=payload,headers=header)
-
-    if not r:
-        raise Exception(r.text)
-
-    results = r.json()
-
-    if len(results) == 0:
-        raise Exception("No board found with this batch/board number!")
-    if len(results) > 1:
-        raise Exception("Multiple boards exist with this batch/board number!")
-
-    r = results.pop()
-    uuid = r['componentUuid']
-
-    fullurl = baseurl + '/' + uuid
+from board_index import find_board, resolve_boards, search_batch
+from board_range import parse_board_range
 
+def render_label(fullurl, filename):
+    """
+    render the qr code for fullurl, save it to filename and return it as an svg string
+    """
     import qrcode
     import qrcode.image.svg
     qr = qrcode.QRCode()
     qr.add_data(fullurl)
     img = qr.make_image(image_factory=qrcode.image.svg.SvgPathImage)
-    img.save(f'{dir}/Batch_{batch}_board_{board}.svg')
-
-def main():
+    img.save(filename)
+    return img.to_string(encoding='unicode')
+
+def write_sheet(labels, filename, columns=5):
+    """
+    place a list of (caption, svg string) labels on a grid in one svg file
+    """
+    size = max(float(re.search(r'width="([\d.]+)mm"',svg).group(1)) for caption,svg in labels)
+    cell_height = size+5
+    rows = (len(labels)+columns-1)//columns
+    with open(filename,'w') as fl:
+        fl.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{columns*size}mm" height="{rows*cell_height}mm">\n')
+        for n, (caption, svg) in enumerate(labels):
+            x = (n%columns)*size
+            y = (n//columns)*cell_height
+            svg = re.sub(r'<\?xml[^>]*\?>','',svg).strip()
+            svg = re.sub(r'<((?:\w+:)?svg)\b',f'<\\1 x="{x}mm" y="{y}mm"',svg,count=1)
+            fl.write(svg+'\n')
+            fl.write(f'<text x="{x+size/2}mm" y="{y+size+3}mm" font-size="3mm" text-anchor="middle">{caption}</text>\n')
+        fl.write('</svg>\n')
+
+def render_labels(baseurl, batch, uuids, dir, jobs=None, sheet=False):
+    """
+    render labels for a {board: uuid} dict of one batch
+    small sets are rendered in this process, larger ones across a process pool
+    """
+    boards = sorted(uuids)
+    fullurls = [baseurl + '/' + uuids[board] for board in boards]
+    filenames = [f'{dir}/Batch_{batch}_board_{board}.svg' for board in boards]
+
+    if jobs == 1 or len(boards) < 16:
+        svgs = list(map(render_label,fullurls,filenames))
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            svgs = list(pool.map(render_label,fullurls,filenames,chunksize=16))
+
+    if sheet:
+        captions = [f'Batch {batch} board {board}' for board in boards]
+        write_sheet(list(zip(captions,svgs)),f'{dir}/Batch_{batch}_labels.svg')
+
+    print(f"Generated {len(boards)} labels for batch {batch}")
+
+def read_manifest(filename):
+    """
+    {(batch, board): uuid} from a csv file with batchId,boardId,componentUuid columns
+    """
+    import csv
+    with open(filename) as fl:
+        return {(int(row['batchId']),int(row['boardId'])):row['componentUuid'] for row in csv.DictReader(fl)}
+
+def read_baseurl(config_file='config.dat'):
+    import json
+    with open(config_file) as conf_file:
+        return json.load(conf_file)['url']
+
+def upload(batch, board, dir, client=None):
+
+    if client is None:
+        from sietch_client import connect
+        client = connect()
+
+    uuid = find_board(client,batch,board)
+
+    fullurl = client.baseurl + '/' + uuid
+
+    render_label(fullurl,f'{dir}/Batch_{batch}_board_{board}.svg')
+
+def upload_batch(batch, boards, dir, client=None, jobs=None, sheet=False):
+    """
+    labels for a list of boards in one batch, or every registered board if boards is None
+    """
+    if client is None:
+        from sietch_client import connect
+        client = connect()
+
+    if boards is None:
+        index = search_batch(client,batch)
+        boards = sorted(board for b,board in index)
+    else:
+        index = resolve_boards(client,[(batch,board) for board in boards])
+
+    has_bad_boards = False
+    for board in boards:
+        results = index.get((batch,board),[])
+        if len(results) == 0:
+            has_bad_boards = True
+            print(f"No board found with batch ID {batch} board ID {board}", file=sys.stderr)
+        elif len(results) > 1:
+            has_bad_boards = True
+            print(f"Multiple boards exist with batch ID {batch} board ID {board}!", file=sys.stderr)
+
+    if has_bad_boards:
+        raise Exception("Bad board configurations found!")
+
+    uuids = {board:index[(batch,board)][0] for board in boards}
+    render_labels(client.baseurl,batch,uuids,dir,jobs=jobs,sheet=sheet)
+
+def upload_offline(batch, boards, dir, known_uuids, baseurl, jobs=None, sheet=False):
+    """
+    labels from a local {(batch, board): uuid} dict, without any network access
+    every known board of the batch is labelled if boards is None
+    """
+    if boards is None:
+        boards = [board for b,board in known_uuids if b == batch]
+
+    missing = [board for board in boards if (batch,board) not in known_uuids]
+    if len(missing) > 0:
+        raise Exception(f"No UUID known locally for batch {batch} boards {missing}")
+
+    uuids = {board:known_uuids[(batch,board)] for board in boards}
+    render_labels(baseurl,batch,uuids,dir,jobs=jobs,sheet=sheet)
+
+def main(argv=None, prog=None):
     import argparse
-    parser = argparse.ArgumentParser()
+    from sietch_client import add_arguments, connect_from_args
+    parser = argparse.ArgumentParser(prog=prog)
     parser.add_argument('-B','--batch',help='Batch number',type=int,required=True)
-    parser.add_argument('-b','--board',help='Board number',type=int,required=True)
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('-b','--board',help='Board number, or list/range of board numbers (e.g. 3,7,12-40)',type=parse_board_range)
+    group.add_argument('--all',help='Every board registered in the batch',action='store_true')
     parser.add_argument('-d','--dir',help='Image output directory',default='.')
-    args = parser.parse_args()
-    upload(args.batch,args.board,args.dir)
+    parser.add_argument('-j','--jobs',help='Number of rendering processes (default: number of CPUs)',type=int)
+    parser.add_argument('--sheet',help='Also write all labels to a single svg sheet',action='store_true')
+    add_arguments(parser)
+    offline = parser.add_mutually_exclusive_group()
+    offline.add_argument('--manifest',help='Render offline from a csv file of batchId,boardId,componentUuid')
+    offline.add_argument('--offline',help='Render offline from the local UUID cache',action='store_true')
+    parser.add_argument('--url',help='Database url for offline labels (default: url in config.dat)')
+    args = parser.parse_args(argv)
+    boards = None if args.all else args.board
+    if args.manifest or args.offline:
+        baseurl = args.url or read_baseurl()
+        if args.manifest:
+            known_uuids = read_manifest(args.manifest)
+        else:
+            from uuid_cache import open_cache
+            cache = open_cache()
+            if cache.url() not in (None,baseurl):
+                raise Exception(f"The UUID cache was filled from {cache.url()}, not {baseurl}!")
+            known_uuids = cache.items()
+        upload_offline(args.batch,boards,args.dir,known_uuids,baseurl,jobs=args.jobs,sheet=args.sheet)
+        return
+
+    client = connect_from_args(args)
+    if not args.all and len(args.board) == 1 and not args.sheet:
+        upload(args.batch,args.board[0],args.dir,client=client)
+    else:
+        upload_batch(args.batch,boards,args.dir,client=client,jobs=args.jobs,sheet=args.sheet)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+"""
+usage: mock_sietch_server.py (-p [port]) (-l [latency in seconds]) (--no-etags) (--no-partial-updates)
+Local in-memory stand-in for the Sietch database, for testing and benchmarking.
+Implements /machineAuthenticate, /api/search/component/<type>,
+/api/component/<uuid> and /api/generateComponentUuid,
+with a configurable delay added to every request.
+Components carry a version sent as ETag and checked against If-Match on writes,
+and PATCH /api/component/<uuid> merges the given data keys;
+both can be switched off to behave like a server without them.
+GETs with a current If-None-Match are answered with 304, responses are gzip
+encoded if the client accepts it and gzip encoded request bodies are accepted.
+Point the url in config.dat at http://localhost:[port] to use it.
+"""
+
+import gzip
+import json
+import threading
+import time
+import uuid as uuidlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+token = 'mock-token'
+
+def matches(component, query):
+    for key, value in query.items():
+        doc = component
+        for k in key.split('.'):
+            if not isinstance(doc,dict) or k not in doc:
+                return False
+            doc = doc[k]
+        if doc != value:
+            return False
+    return True
+
+class MockSietchHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body, etag=None):
+        data = body if isinstance(body,bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('content-type','application/json')
+        if len(data) > 1024 and 'gzip' in self.headers.get('accept-encoding',''):
+            data = gzip.compress(data,compresslevel=5)
+            self.send_header('content-encoding','gzip')
+        self.send_header('content-length',str(len(data)))
+        if etag is not None and self.server.etags:
+            self.send_header('etag',etag)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self):
+        length = int(self.headers.get('content-length',0))
+        body = self.rfile.read(length) if length > 0 else b''
+        if self.headers.get('content-encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return body
+
+    def handle_request(self, method):
+        server = self.server
+        body = self.read_body()
+        path = unquote(self.path)
+        time.sleep(server.latency)
+
+        if path == '/machineAuthenticate' and method == 'POST':
+            server.count('auth')
+            return self.reply(200,token.encode())
+
+        if self.headers.get('authorization') != 'Bearer '+token:
+            server.count('unauthorized')
+            return self.reply(401,b'Unauthorized')
+
+        if path.startswith('/api/search/component/') and method == 'POST':
+            server.count('search')
+            component_type = path[len('/api/search/component/'):]
+            query = json.loads(body)
+            with server.lock:
+                results = [dict(componentUuid=u,**c) for u,c in server.components.items() if c['type'] == component_type and matches(c,query)]
+            return self.reply(200,results)
+
+        if path == '/api/generateComponentUuid' and method == 'GET':
+            server.count('generateComponentUuid')
+            return self.reply(200,uuidlib.uuid4().hex)
+
+        if path.startswith('/api/component/'):
+            uuid = path[len('/api/component/'):]
+            if method == 'GET':
+                server.count('get')
+                with server.lock:
+                    component = server.components.get(uuid)
+                    etag = server.etag(uuid)
+                if component is None:
+                    return self.reply(404,b'Not found')
+                if server.etags and self.headers.get('if-none-match') == etag:
+                    server.count('not_modified')
+                    return self.reply(304,b'',etag)
+                return self.reply(200,dict(componentUuid=uuid,**component),etag)
+            if method == 'POST' or (method == 'PATCH' and server.partial_updates):
+                server.count(method.lower())
+                update = json.loads(body)
+                with server.lock:
+                    if_match = self.headers.get('if-match')
+                    if server.etags and if_match is not None and if_match != server.etag(uuid):
+                        return self.reply(412,b'Precondition failed')
+                    if method == 'POST':
+                        server.components[uuid] = {'type':update['type'],'data':update['data']}
+                    elif uuid in server.components:
+                        server.components[uuid]['data'].update(update['data'])
+                    else:
+                        return self.reply(404,b'Not found')
+                    server.versions[uuid] = server.versions.get(uuid,0)+1
+                    etag = server.etag(uuid)
+                return self.reply(200,{'componentUuid':uuid},etag)
+
+        return self.reply(404,b'Not found')
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PATCH(self):
+        self.handle_request('PATCH')
+
+class MockSietchServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, latency=0., etags=True, partial_updates=True):
+        super().__init__(address,MockSietchHandler)
+        self.latency = latency
+        self.etags = etags
+        self.partial_updates = partial_updates
+        self.lock = threading.Lock()
+        self.components = {}
+        self.versions = {}
+        self.requests = {}
+
+    def etag(self, uuid):
+        return f'"{self.versions.get(uuid,0)}"'
+
+    def count(self, endpoint):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint,0)+1
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+def start(port=0, latency=0., etags=True, partial_updates=True):
+    """
+    run a mock server in a background thread, returns the server
+    """
+    server = MockSietchServer(('127.0.0.1',port),latency,etags,partial_updates)
+    threading.Thread(target=server.serve_forever,daemon=True).start()
+    return server
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p','--port',help='Port to listen on',type=int,default=8123)
+    parser.add_argument('-l','--latency',help='Delay added to every request, in seconds',type=float,default=0.)
+    parser.add_argument('--no-etags',help='Do not send ETags or check If-Match',action='store_true')
+    parser.add_argument('--no-partial-updates',help='Do not accept PATCH requests',action='store_true')
+    args = parser.parse_args()
+    server = MockSietchServer(('127.0.0.1',args.port),args.latency,not args.no_etags,not args.no_partial_updates)
+    print(f"Mock Sietch server on {server.url}")
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -9,80 +9,26 @@ will fail if that board doesn't already have position measurements in the databa
 """
 
 
-import json
-import requests
 import os
-import csv
 import sys
-import datetime
-
-from sietch_config import board_component_name
-from camelcase import camelcase
-
-def upload(target_batch, target_board, measurement_file):
-
-    measurements = {}
-    header_batch = 'BATCH_ID'
-    header_board = 'BOARD_ID'
-    header_time = 'Measurement time'
-    for f in [measurement_file]:
-        headers = []
-        with open(f) as fl:
-            cf = csv.reader(fl)
-            for row in cf:
-                if len(headers) == 0:
-                    headers = row
-                    for pos,h in enumerate(headers):
-                        if h == header_batch: pos_batch = pos
-                        if h == header_board: pos_board = pos
-                        if h == header_time: pos_time = pos
-                elif len(row) > 0: # there could be empty rows
-                    if len(row[pos_batch]) == 0:
-                        # Tolerance rows in csv file
-                        continue
-                    batch = int(row[pos_batch])
-                    board = int(row[pos_board])
-                    if batch != target_batch and board != target_board:
-                        continue
-                    time = str(datetime.datetime.strptime(row[pos_time], '%m/%d/%Y %I:%M:%S %p'))
-                    if batch not in measurements.keys():
-                        measurements[batch] = {}
-                    if board not in measurements[batch].keys():
-                        measurements[batch][board] = {'measurements':{ 'measurementTime':time }}
-                    for i in range(len(row)):
-                        h = headers[i]
-                        if ':' in h and h.split(':')[0] in ['1','2']:
-                            hd = h.split(':')[1]
-                            hd_camelcase = camelcase(hd)
-                            measurements[batch][board]['measurements']['position'+hd_camelcase] = float(row[i])
-
-    with open('config.dat') as conf_file:
-        config = json.load(conf_file)
-        baseurl = config['url']
-
-    header = { 'content-type': 'application/json' }
-
-    r = requests.post(baseurl+'/machineAuthenticate',json=config['auth'],headers=header)
-    if not r:
-        raise Exception(r.text)
-
-    token=r.text
-
-    header['authorization']='Bearer '+token
+
+from sietch_client import connect, add_arguments, connect_from_args
+from board_index import resolve_boards
+from position_csv import read_measurements
+
+def upload(target_batch, target_board, measurement_file, client=None):
+
+    measurements = read_measurements([measurement_file],target=(target_batch,target_board))
+
+    if client is None:
+        client = connect()
+
+    index = resolve_boards(client,[(batch,board) for batch in measurements for board in measurements[batch]])
 
     has_bad_boards = False
     for batch in measurements:
         for board in measurements[batch]:
-            search_payload = {
-                    'data.batchId':batch,
-                    'data.boardId':board,
-                    }
-            r = requests.post(baseurl+'/api/search/component/'+board_component_name,json=search_payload,headers=header)
-
-            if not r:
-                raise Exception(r.text)
-
-            results = r.json()
+            results = index.get((batch,board),[])
 
             if len(results) == 0:
                 #bad_boards.append(batch,board,len(results))
@@ -93,9 +39,7 @@ def upload(target_batch, target_board, measurement_file):
                 has_bad_boards=True
                 print(f"Multiple boards exist with batch ID {batch} board ID {board}!", file=sys.stderr)
             else:
-                r = results.pop()
-                uuid = r['componentUuid']
-                measurements[batch][board]['uuid']=uuid
+                measurements[batch][board]['uuid']=results[0]
 
 
     if has_bad_boards:
@@ -105,16 +49,8 @@ def upload(target_batch, target_board, measurement_file):
     for batch in measurements:
         for board in measurements[batch]:
             uuid = measurements[batch][board]['uuid']
-            r = requests.get(baseurl+'/api/component/'+uuid,headers=header)
-            if not r:
-                raise Exception(r.text)
-
-            payload = r.json()
+            etag, payload = client.fetch_for_update(uuid)
 
-            for k in list(payload):
-                if k != 'type' and k != 'data':
-                    payload.pop(k)
-            
             key='qcPositionMeasurements'
             timekey = 'measurementTime'
             if key in payload['data'] \
@@ -125,29 +61,31 @@ def upload(target_batch, target_board, measurement_file):
             
             payload['data'][key]=measurements[batch][board]['measurements']
             measurements[batch][board]['payload'] = payload
+            measurements[batch][board]['etag'] = etag
 
     if has_bad_boards:
-        raise Exception("No previous measurements found for batch {target_batch} board {target_board}!")
+        raise Exception(f"No previous measurements found for batch {target_batch} board {target_board}!")
 
     for batch in measurements:
         for board in measurements[batch]:
             uuid = measurements[batch][board]['uuid']
             payload = measurements[batch][board]['payload']
-            
-            r = requests.post(baseurl+'/api/component/'+uuid,json=payload,headers=header)
-            if not r:
-                raise Exception(r.text)
+            etag = measurements[batch][board]['etag']
+
+            if not client.write_component(uuid,payload,['qcPositionMeasurements'],etag):
+                raise Exception(f"Batch {batch} board {board} was modified by someone else during the overwrite, please try again!")
             print(f"Overwrote QC position measurements for batch {batch} board {board}")
 
 
-def main():
+def main(argv=None, prog=None):
     import argparse
-    parser = argparse.ArgumentParser()
+    parser = argparse.ArgumentParser(prog=prog)
     parser.add_argument('-B','--batch',help='Batch number',type=int,required=True)
     parser.add_argument('-b','--board',help='Board number',type=int,required=True)
     parser.add_argument('file',help='CSV file to parse')
-    args = parser.parse_args()
-    upload(args.batch,args.board,args.file)
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    upload(args.batch,args.board,args.file,client=connect_from_args(args))
 
 if __name__ == '__main__':
     main()
@@ -9,98 +9,54 @@ will fail if that board doesn't already have this position measurement in the da
 """
 
 
-import json
-import requests
-import os
+from sietch_client import connect, add_arguments, connect_from_args
+from board_index import find_board
+from thickness_file import read_thickness_files, to_list
 
-from sietch_config import board_component_name
+def upload(batch, board, measurement_file, client=None):
 
-def upload(batch, board, measurement_file):
+    measurements = read_thickness_files([measurement_file])
 
-    measurements = {}
-    for f in [measurement_file]:
-        fn = os.path.basename(f)
-        fn = os.path.splitext(fn)[0]
-        with open(f) as fl:
-            measurements[fn] = [float(e.strip()) for e in fl.readlines()]
+    if client is None:
+        client = connect()
 
-    with open('config.dat') as conf_file:
-        config = json.load(conf_file)
-        baseurl = config['url']
+    uuid = find_board(client,batch,board)
 
-    header = { 'content-type': 'application/json' }
-
-    r = requests.post(baseurl+'/machineAuthenticate',json=config['auth'],headers=header)
-    if not r:
-        raise Exception(r.text)
-
-    token=r.text
-
-    header['authorization']='Bearer '+token
-
-    payload={
-        'data.batchId':batch,
-        'data.boardId':board,
-        }
-
-    r = requests.post(baseurl+'/api/search/component/'+board_component_name,json=payload,headers=header)
-
-    if not r:
-        raise Exception(r.text)
-
-    results = r.json()
-
-    if len(results) == 0:
-        raise Exception("No board found with this batch/board number!")
-    if len(results) > 1:
-        raise Exception("Multiple boards exist with this batch/board number!")
-
-    r = results.pop()
-    uuid = r['componentUuid']
-
-    r = requests.get(baseurl+'/api/component/'+uuid,headers=header)
-    if not r:
-        raise Exception(r.text)
-
-    payload = r.json()
-
-    for k in list(payload):
-        if k != 'type' and k != 'data':
-            payload.pop(k)
-    
     key='qcThicknessMeasurements'
-    if key not in payload['data']:
-        payload['data'][key]=[]
 
-    existing_measurements = [existing_measurement['measurementLabel'] for existing_measurement in payload['data'][key]]
-    for m in measurements:
-        if m not in existing_measurements:
-            print(f"WARNING! measurement {name} is not in the database! please use upload script!")
-            measurements.pop(name)
+    def update(payload):
+        if key not in payload['data']:
+            payload['data'][key]=[]
+
+        existing_measurements = [existing_measurement['measurementLabel'] for existing_measurement in payload['data'][key]]
+        for m in list(measurements):
+            if m not in existing_measurements:
+                print(f"WARNING! measurement {m} is not in the database! please use upload script!")
+                measurements.pop(m)
 
-    if len(measurements) == 0:
-        print("No data to upload")
-        return
+        if len(measurements) == 0:
+            print("No data to upload")
+            return []
 
-    for m in measurements:
-        for em in payload['data'][key]:
-            if em['measurementLabel'] == m:
-                em['measurement'] = measurements[m]
+        for m in measurements:
+            for em in payload['data'][key]:
+                if em['measurementLabel'] == m:
+                    em['measurement'] = to_list(measurements[m])
+        return [key]
 
-    r = requests.post(baseurl+'/api/component/'+uuid,json=payload,headers=header)
-    if not r:
-        raise Exception(r.text)
-    print(f"Overwritten batch {batch} board {board} measurement {fn}")
+    if client.update_component(uuid,update):
+        print(f"Overwritten batch {batch} board {board} measurement {', '.join(measurements)}")
 
 
-def main():
+def main(argv=None, prog=None):
     import argparse
-    parser = argparse.ArgumentParser()
+    parser = argparse.ArgumentParser(prog=prog)
     parser.add_argument('-B','--batch',help='Batch number',type=int,required=True)
     parser.add_argument('-b','--board',help='Board number',type=int,required=True)
     parser.add_argument('file',help='CSV file to parse')
-    args = parser.parse_args()
-    upload(args.batch,args.board,args.file)
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    upload(args.batch,args.board,args.file,client=connect_from_args(args))
 
 if __name__ == '__main__':
     main()
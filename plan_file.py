@@ -0,0 +1,59 @@
+"""
+Plan files written by the --plan option of the registration and upload scripts,
+and carried out by their --apply option without repeating the lookups.
+A plan is a json document with the command and its arguments, the database url,
+the actions that will be taken, the problems that would stop the run (errors),
+and the number of requests made to plan it and needed to apply it.
+Once applied, a plan is marked as such and cannot be applied again.
+"""
+
+import datetime
+import json
+import sys
+
+def make_plan(command, url, arguments, actions, errors, lookups, writes):
+    return {
+            'command':command,
+            'url':url,
+            'created':str(datetime.datetime.now().replace(microsecond=0)),
+            'arguments':arguments,
+            'actions':actions,
+            'errors':errors,
+            'requests':{'lookups':lookups,'writes':writes},
+            }
+
+def write_plan(filename, plan):
+    with open(filename,'w') as fl:
+        json.dump(plan,fl,indent=1)
+
+def mark_applied(filename, plan):
+    plan['applied'] = str(datetime.datetime.now().replace(microsecond=0))
+    write_plan(filename,plan)
+
+def print_plan(plan, describe, file=sys.stdout):
+    """
+    describe(action) returns the line printed for each action
+    """
+    print(f"Plan for {plan['command']} against {plan['url']}:",file=file)
+    for action in plan['actions']:
+        print('  '+describe(action),file=file)
+    for error in plan['errors']:
+        print('  ERROR: '+error,file=file)
+    print(f"{len(plan['actions'])} actions, {plan['requests']['writes']} requests to apply "
+          f"({plan['requests']['lookups']} read-only requests were made to plan them)",file=file)
+
+def read_plan(filename, command, url):
+    """
+    load a plan for command, refusing plans with errors, made for another database, or already applied
+    """
+    with open(filename) as fl:
+        plan = json.load(fl)
+    if plan['command'] != command:
+        raise Exception(f"{filename} is a plan for {plan['command']}, not {command}!")
+    if plan['url'] != url:
+        raise Exception(f"{filename} was planned against {plan['url']}, not {url}!")
+    if 'applied' in plan:
+        raise Exception(f"{filename} was already applied on {plan['applied']}!")
+    if len(plan['errors']) > 0:
+        raise Exception(f"{filename} has errors, please fix them and plan again: "+'; '.join(plan['errors']))
+    return plan
@@ -0,0 +1,322 @@
+"""
+Streaming parser for CMM position measurement csv files.
+The header is resolved once into a map of column index -> position<CamelCase> key,
+then rows are yielded one at a time so memory does not grow with the file.
+The position columns of a row are picked with one itemgetter and converted with
+a single map(float), and measurement times are parsed by a fixed-format parser
+memoised per distinct string (rows of the same board share their time).
+read_new_rows parses only what was appended to a file since a byte offset.
+RowIndex is a sidecar file ([file].idx) with the byte offset of every board's rows,
+checked against the file size, mtime and the bytes before the indexed offset:
+single boards can be read without parsing the file, and when the file has only
+grown just the appended tail is parsed to bring the index up to date.
+"""
+
+import csv
+import datetime
+import functools
+import hashlib
+import json
+import os
+import sys
+from operator import itemgetter
+
+from camelcase import camelcase
+
+header_batch = 'BATCH_ID'
+header_board = 'BOARD_ID'
+header_time = 'Measurement time'
+time_format = '%m/%d/%Y %I:%M:%S %p'
+
+class PositionHeader:
+
+    def __init__(self, headers):
+        for pos,h in enumerate(headers):
+            if h == header_batch: self.pos_batch = pos
+            if h == header_board: self.pos_board = pos
+            if h == header_time: self.pos_time = pos
+        self.columns = []
+        for pos,h in enumerate(headers):
+            fields = h.split(':')
+            if len(fields) > 1 and fields[0] in ['1','2']:
+                self.columns.append((pos,'position'+camelcase(fields[1])))
+        self.keys = [key for pos,key in self.columns]
+        # rows this long have every position column
+        self.full_length = max((pos+1 for pos,key in self.columns),default=0)
+        positions = [pos for pos,key in self.columns]
+        if len(positions) == 1:
+            self.get_values = lambda row: (row[positions[0]],)
+        elif len(positions) > 1:
+            self.get_values = itemgetter(*positions)
+        else:
+            self.get_values = lambda row: ()
+
+    def parse(self, row):
+        """
+        returns (batch, board, time string, {position key: value}),
+        or None for empty and tolerance rows
+        """
+        if len(row) == 0 or len(row[self.pos_batch]) == 0:
+            return None
+        nrow = len(row)
+        if nrow >= self.full_length:
+            values = dict(zip(self.keys,map(float,self.get_values(row))))
+        else:
+            values = {key:float(row[pos]) for pos,key in self.columns if pos < nrow}
+        return int(row[self.pos_batch]), int(row[self.pos_board]), row[self.pos_time], values
+
+def read_rows(filename):
+    """
+    yield (batch, board, time string, values) for every measurement row in file
+    """
+    with open(filename) as fl:
+        header = None
+        for row in csv.reader(fl):
+            if header is None:
+                if len(row) > 0:
+                    header = PositionHeader(row)
+                continue
+            record = header.parse(row)
+            if record is not None:
+                yield record
+
+def scan_lines(filename, offset=0, header=None, final_line=False):
+    """
+    yield (offset of line, offset after line, header row, record or None) for every line after byte offset
+    header is the header row if offset is past it
+    a last line without its newline is not read, it may still be being written, unless final_line is set
+    """
+    position_header = None if header is None else PositionHeader(header)
+    with open(filename,'rb') as fl:
+        fl.seek(offset)
+        # one csv reader for the whole file, fed by a generator that keeps track of the offset
+        end = [offset]
+
+        def lines():
+            for line in fl:
+                if not line.endswith(b'\n') and not final_line:
+                    return
+                end[0] += len(line)
+                yield line.decode()
+
+        for row in csv.reader(lines()):
+            start, offset = offset, end[0]
+            record = None
+            if position_header is None:
+                if len(row) > 0:
+                    header = row
+                    position_header = PositionHeader(row)
+            else:
+                record = position_header.parse(row)
+            yield start, offset, header, record
+
+def read_new_rows(filename, offset=0, header=None):
+    """
+    parse the complete lines appended to filename after byte offset
+    header is the header row returned by the previous call (None to start from the top)
+    returns (header row, offset after the last complete line, list of (batch, board, time string, values))
+    """
+    records = []
+    for start, offset, header, record in scan_lines(filename,offset,header):
+        if record is not None:
+            records.append(record)
+    return header, offset, records
+
+index_suffix = '.idx'
+
+class RowIndex:
+    """
+    byte offsets of the rows of each board in a csv file, kept in a sidecar file
+    offset is how far the file has been indexed, uploaded how far its rows
+    have been uploaded (see upload_position_measurements.py)
+    a last line without its newline is read but never indexed, it may still be being written;
+    end is how far the last rows() read, past offset if it read such a line, and uploaded
+    may be too, if that line was uploaded
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.clear()
+        try:
+            with open(filename+index_suffix) as fl:
+                saved = json.load(fl)
+            self.size, self.mtime, self.offset = saved['size'], saved['mtime'], saved['offset']
+            self.check, self.header, self.uploaded = saved['check'], saved['header'], saved['uploaded']
+            self.boards = {tuple(int(i) for i in k.split(',')):v for k,v in saved['boards'].items()}
+        except (OSError,ValueError,KeyError):
+            self.clear()
+
+    def clear(self):
+        self.size = self.mtime = self.offset = self.uploaded = self.end = 0
+        self.check = ''
+        self.header = None
+        self.boards = {}
+
+    def prefix_check(self):
+        """
+        hash of the bytes just before the indexed offset, to tell an append from a rewrite
+        """
+        with open(self.filename,'rb') as fl:
+            start = max(self.offset-4096,0)
+            fl.seek(start)
+            return hashlib.sha1(fl.read(self.offset-start)).hexdigest()
+
+    def validate(self):
+        """
+        forget everything if the file was rewritten rather than appended to
+        returns the stat of the file
+        """
+        stat = os.stat(self.filename)
+        if stat.st_size < self.offset or self.prefix_check() != self.check:
+            self.clear()
+        return stat
+
+    def rows(self, start=0, final_line=True):
+        """
+        yield the rows after byte offset start (0, or a row boundary such as uploaded),
+        indexing the ones past the indexed offset on the way
+        a last line without its newline is only read if final_line (the file is finished)
+        """
+        # start is past offset if the last line was read before its newline was written
+        scan_start = min(start,self.offset)
+        header = self.header if scan_start > 0 else None
+        self.end = scan_start
+        for line_start, self.end, header, record in scan_lines(self.filename,scan_start,header):
+            if self.end > self.offset:
+                self.header, self.offset = header, self.end
+                if record is not None:
+                    self.boards.setdefault((record[0],record[1]),[]).append(line_start)
+            if record is not None and line_start >= start:
+                yield record
+        last = self.last_line(self.end,header) if final_line else None
+        if last is not None:
+            line_end, record = last
+            if self.end >= start:
+                yield record
+            self.end = line_end
+
+    def last_line(self, offset, header):
+        """
+        (offset after it, record) of a last line without its newline starting at offset, or None
+        """
+        if header is None:
+            return None
+        with open(self.filename,'rb') as fl:
+            fl.seek(offset)
+            line = fl.read()
+        if len(line) == 0 or b'\n' in line:
+            # nothing, or a line completed since it was scanned: it is read next time
+            return None
+        row = next(csv.reader([line.decode(errors='replace')]),[])
+        try:
+            return offset+len(line), PositionHeader(header).parse(row)
+        except (ValueError,IndexError):
+            print(f"Skipping the unfinished last line of {self.filename}",file=sys.stderr)
+            return None
+
+    def finish(self, stat):
+        """
+        save the index after rows() has reached the end of the file, stat is from validate()
+        """
+        self.size, self.mtime = stat.st_size, stat.st_mtime
+        self.check = self.prefix_check()
+        self.save()
+
+    def update(self):
+        """
+        bring the index up to date, parsing only what was appended since it was saved
+        returns self
+        """
+        stat = os.stat(self.filename)
+        if stat.st_size == self.size and stat.st_mtime == self.mtime:
+            return self
+        stat = self.validate()
+        for record in self.rows(self.offset):
+            pass
+        self.finish(stat)
+        return self
+
+    def save(self):
+        saved = {
+                'size':self.size,
+                'mtime':self.mtime,
+                'offset':self.offset,
+                'check':self.check,
+                'header':self.header,
+                'uploaded':self.uploaded,
+                'boards':{f'{batch},{board}':v for (batch,board),v in self.boards.items()},
+                }
+        try:
+            with open(self.filename+index_suffix,'w') as fl:
+                json.dump(saved,fl)
+        except OSError:
+            # e.g. a read-only export directory: the index is only used for this run
+            pass
+
+    def read_board(self, batch, board):
+        """
+        list of (batch, board, time string, values) rows of one board, read straight from their offsets
+        (and the unindexed last line if it is one of them)
+        """
+        records = []
+        if (batch,board) in self.boards:
+            position_header = PositionHeader(self.header)
+            with open(self.filename,'rb') as fl:
+                for offset in self.boards[(batch,board)]:
+                    fl.seek(offset)
+                    row = next(csv.reader([fl.readline().decode()]))
+                    records.append(position_header.parse(row))
+        last = self.last_line(self.offset,self.header)
+        if last is not None and (last[1][0],last[1][1]) == (batch,board):
+            records.append(last[1])
+        return records
+
+def open_index(filename):
+    """
+    the up to date RowIndex of a csv file
+    """
+    return RowIndex(filename).update()
+
+@functools.lru_cache(maxsize=4096)
+def parse_time(s):
+    """
+    'MM/DD/YYYY HH:MM:SS AM' -> 'YYYY-MM-DD HH:MM:SS', the same as str(strptime(s, time_format))
+    anything the fast path does not handle goes through strptime, which also reports errors
+    """
+    try:
+        date, clock, ampm = s.split(' ')
+        month, day, year = date.split('/')
+        hour, minute, second = clock.split(':')
+        digits = (month+day+year+hour+minute+second).isdigit()
+        hour = int(hour)
+        ampm = ampm.upper()
+        if digits and len(year) == 4 and 1 <= hour <= 12 and ampm in ('AM','PM'):
+            hour = hour%12 + (12 if ampm == 'PM' else 0)
+            return str(datetime.datetime(int(year),int(month),int(day),hour,int(minute),int(second)))
+    except ValueError:
+        pass
+    return str(datetime.datetime.strptime(s, time_format))
+
+def read_measurements(files, target=None):
+    """
+    collect rows into {batch: {board: {'measurements': {...}}}}
+    the time is taken from the first row of a board, values from the last
+    if target is a (batch, board) pair, only that board is read, using the files' RowIndex
+    """
+    measurements = {}
+    for f in files:
+        rows = read_rows(f) if target is None else open_index(f).read_board(*target)
+        for batch, board, time, values in rows:
+            add_row(measurements,batch,board,time,values)
+    return measurements
+
+def add_row(measurements, batch, board, time, values):
+    """
+    merge one row into measurements, returns True if this is a new board
+    """
+    boards = measurements.setdefault(batch,{})
+    new_board = board not in boards
+    if new_board:
+        boards[board] = {'measurements':{ 'measurementTime':parse_time(time) }}
+    boards[board]['measurements'].update(values)
+    return new_board
@@ -1,120 +1,254 @@
 #!/usr/bin/env python
 
 """
-usage: register_new_batch.py -B [batch] -N [number of boards] -t [type of board]
+usage: register_new_batch.py -B [batch] -N [number of boards] -t [type of board] (-j [workers]) (--plan [plan file])
+       register_new_batch.py --apply [plan file] (-j [workers])
 Register a new batch of boards in the system.
+Registered boards are recorded in a local journal; if the run is interrupted
+or some boards fail, rerunning the same command resumes where it stopped.
+With --plan, nothing is registered: what would be done is printed and written
+to a plan file, which --apply then carries out with a single lookup, checking that
+the batch is still not registered.
 """
 
-import json
-import requests
 import os
 import sys
-
-from board_types import types
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from board_index import search_batch
+from board_types import types, board_type
+from checkpoint import open_journal
+from plan_file import make_plan, write_plan, print_plan, read_plan, mark_applied
+from sietch_client import connect, add_arguments, connect_from_args
 from sietch_config import batch_component_name, board_component_name
+from uuid_pool import UuidPool
 
-def upload(batch, number, type_of_board):
-
-    with open('config.dat') as conf_file:
-        config = json.load(conf_file)
-        baseurl = config['url']
-
-    header = { 'content-type': 'application/json' }
-
-    r = requests.post(baseurl+'/machineAuthenticate',json=config['auth'],headers=header)
-    if not r:
-        raise Exception(r.text)
-
-    token=r.text
-
-    header['authorization']='Bearer '+token
-
-    payload={
-        'data.batchId':batch,
-        }
-
-    r = requests.post(baseurl+'/api/search/component/'+batch_component_name,json=payload,headers=header)
-
-    if not r:
-        raise Exception(r.text)
+def register_board(client, batch, board, type_of_board, journal=None, new_uuid=None):
+    """
+    Register a single board, returns (board, registered, latency in seconds)
+    new_uuid returns the UUID to use (e.g. UuidPool.get), by default one is generated
+    """
+    start = time.perf_counter()
 
-    results = r.json()
-
-    if len(results) > 0:
-        raise Exception("This batch has already been registered")
-
-    r = requests.get(baseurl+'/api/generateComponentUuid',headers=header)
-    if not r:
-        raise Exception(r.text)
-
-    uuid = r.json()
+    uuid = new_uuid() if new_uuid is not None else client.generate_uuid()
+    payload = {
+            'type':board_component_name,
+            'data':{
+                'name':f"Batch {batch} board {board}",
+                'batchId':batch,
+                'boardId':board,
+                'boardType':board_type(type_of_board),
+                'boardStatus':'received'
+                },
+            }
+    try:
+        client.post_component(uuid,payload)
+    except Exception:
+        print(f"Warning! Failed to register batch {batch} board {board}!!! Please run with standalone registration",file=sys.stderr)
+        return board, False, time.perf_counter()-start
+
+    if client.uuid_cache is not None:
+        client.uuid_cache.put(batch,board,uuid)
+    if journal is not None:
+        journal.add((board,))
+    return board, True, time.perf_counter()-start
+
+def register_batch_component(client, batch, number, type_of_board):
+    uuid = client.generate_uuid()
     payload = {
             'type':batch_component_name,
             'data':{
                 'name':f"Batch {batch}",
                 'batchId':batch,
                 'number':number,
-                'boardType':types[type_of_board],
+                'boardType':board_type(type_of_board),
                 },
             }
-    r = requests.post(baseurl+'/api/component/'+uuid,json=payload,headers=header)
-    if not r:
+    try:
+        client.post_component(uuid,payload)
+    except Exception:
         raise Exception("Failed to register batch!")
-
+    if client.uuid_cache is not None:
+        client.uuid_cache.put_batch(batch,uuid,board_type(type_of_board),number)
+
+def register_boards(client, batch, boards, type_of_board, journal, jobs=1):
+    """
+    register boards concurrently, returns (boards that failed, latencies, elapsed time)
+    their UUIDs are prefetched in the background
+    """
     failed_registrations = []
-    for board in range(1,number+1):
-
+    latencies = []
+    start = time.perf_counter()
+    with UuidPool(client,len(boards),fetchers=jobs) as uuids, ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(register_board,client,batch,board,type_of_board,journal,uuids.get) for board in boards]
+        try:
+            for future in futures:
+                board, registered, latency = future.result()
+                latencies.append(latency)
+                if not registered:
+                    failed_registrations.append(board)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    return failed_registrations, latencies, time.perf_counter()-start
+
+def finish(journal, batch, number, failed_registrations, latencies, elapsed, jobs):
+    nreg = number-len(failed_registrations)
+    print(f"Registered batch {batch} with {nreg} boards")
+    if len(latencies) > 0:
+        latencies.sort()
+        print(f"Per-board latency: mean {sum(latencies)/len(latencies):.3f} s, median {latencies[len(latencies)//2]:.3f} s, max {latencies[-1]:.3f} s")
+        print(f"Throughput: {len(latencies)/elapsed:.1f} boards/s ({elapsed:.1f} s total, {jobs} workers)")
+    if len(failed_registrations) > 0:
+        journal.close()
+        raise Exception(f"Failed to register following board IDs: {failed_registrations}. Please check logs and rerun this command to retry them, or attempt standalone board registrations")
+    journal.remove()
+
+def open_batch_journal(batch, number, type_of_board):
+    """
+    the journal of a batch registration, refusing to resume one started with other arguments
+    """
+    journal = open_journal(f'register_batch_{batch}')
+    for entry in journal.done:
+        if entry[0] == 'batch' and entry != ('batch',number,type_of_board):
+            journal.close()
+            raise Exception(f"An interrupted registration of batch {batch} with {entry[1]} boards of type {entry[2]} exists, "
+                    f"rerun it with -N {entry[1]} -t {entry[2]}, or remove {journal.filename} if the batch was deleted")
+    return journal
+
+def upload(batch, number, type_of_board, client=None, jobs=1):
+
+    if client is None:
+        client = connect(pool_size=max(jobs,10))
+
+    journal = open_batch_journal(batch,number,type_of_board)
+    batch_entry = ('batch',number,type_of_board)
+
+    if batch_entry in journal:
+        print(f"Resuming interrupted registration of batch {batch}")
+    else:
         payload={
             'data.batchId':batch,
-            'data.boardId':board,
             }
 
-        r = requests.post(baseurl+'/api/search/component/'+board_component_name,json=payload,headers=header)
+        results = client.search(batch_component_name,payload)
 
-        if not r:
-            raise Exception(r.text)
+        if len(results) > 0 and not journal.resumed:
+            journal.remove()
+            raise Exception("This batch has already been registered")
 
-        results = r.json()
+        if len(results) == 0:
+            register_batch_component(client,batch,number,type_of_board)
+        journal.add(batch_entry)
 
-        if len(results) > 0:
+    existing = search_batch(client,batch)
+
+    failed_registrations = []
+    boards = []
+    for board in range(1,number+1):
+        if (board,) in journal:
+            continue
+        if (batch,board) in existing:
+            if journal.resumed and len(existing[(batch,board)]) == 1:
+                # registered by the interrupted run just before it stopped
+                journal.add((board,))
+                continue
             print(f"Batch {batch} board {board} has already been registered!",file=sys.stderr)
             failed_registrations.append(board)
             continue
-
-        r = requests.get(baseurl+'/api/generateComponentUuid',headers=header)
-        if not r:
-            raise Exception(r.text)
-
-        uuid = r.json()
-        payload = {
-                'type':board_component_name,
-                'data':{
-                    'name':f"Batch {batch} board {board}",
-                    'batchId':batch,
-                    'boardId':board,
-                    'boardType':types[type_of_board],
-                    'boardStatus':'received'
-                    },
-                }
-        r = requests.post(baseurl+'/api/component/'+uuid,json=payload,headers=header)
-        if not r:
-            print(f"Warning! Failed to register batch {batch} board {board}!!! Please run with standalone registration",file=sys.stderr)
-            failed_registrations.append(board)
-
-    nreg = number-len(failed_registrations)
-    print(f"Registered batch {batch} with {nreg} boards")
-    if len(failed_registrations) > 0:
-        raise Exception(f"Failed to register following board IDs: {failed_registrations}. Please check logs and attempt standalone board registrations")
-
-
-def main():
+        boards.append(board)
+
+    failed_boards, latencies, elapsed = register_boards(client,batch,boards,type_of_board,journal,jobs)
+    finish(journal,batch,number,failed_registrations+failed_boards,latencies,elapsed,jobs)
+
+def plan(batch, number, type_of_board, client=None):
+    """
+    work out what upload would do using read-only requests, returns a plan (see plan_file.py)
+    """
+    if client is None:
+        client = connect()
+
+    lookups = client.request_count
+    actions = []
+    errors = []
+    if len(client.search(batch_component_name,{'data.batchId':batch})) > 0:
+        errors.append(f"Batch {batch} has already been registered")
+    else:
+        actions.append({'action':'register-batch','batch':batch,'number':number,'boardType':board_type(type_of_board)})
+
+    existing = search_batch(client,batch)
+    for board in range(1,number+1):
+        if (batch,board) in existing:
+            errors.append(f"Batch {batch} board {board} has already been registered")
+        else:
+            actions.append({'action':'register-board','batch':batch,'board':board})
+
+    arguments = {'batch':batch,'number':number,'type':type_of_board}
+    # a uuid and a post per component
+    return make_plan('register-batch',client.baseurl,arguments,actions,errors,client.request_count-lookups,2*len(actions))
+
+def describe(action):
+    if action['action'] == 'register-batch':
+        return f"register batch {action['batch']} ({action['number']} boards of type {action['boardType']})"
+    return f"register batch {action['batch']} board {action['board']}"
+
+def apply(plan_filename, client=None, jobs=1):
+    """
+    register the batch and boards of a plan, only looking up the batch again
+    """
+    if client is None:
+        client = connect(pool_size=max(jobs,10))
+
+    plan = read_plan(plan_filename,'register-batch',client.baseurl)
+    batch, number, type_of_board = plan['arguments']['batch'], plan['arguments']['number'], plan['arguments']['type']
+
+    journal = open_batch_journal(batch,number,type_of_board)
+    batch_entry = ('batch',number,type_of_board)
+    if batch_entry in journal:
+        print(f"Resuming interrupted registration of batch {batch}")
+    else:
+        # the one lookup kept: registering the boards of a plan twice would duplicate them
+        if len(client.search(batch_component_name,{'data.batchId':batch})) > 0:
+            journal.remove()
+            raise Exception(f"Batch {batch} has already been registered since {plan_filename} was made")
+        register_batch_component(client,batch,number,type_of_board)
+        journal.add(batch_entry)
+
+    boards = [a['board'] for a in plan['actions'] if a['action'] == 'register-board' and (a['board'],) not in journal]
+    failed_boards, latencies, elapsed = register_boards(client,batch,boards,type_of_board,journal,jobs)
+    if len(failed_boards) == 0:
+        mark_applied(plan_filename,plan)
+    finish(journal,batch,number,failed_boards,latencies,elapsed,jobs)
+
+
+def main(argv=None, prog=None):
     import argparse
-    parser = argparse.ArgumentParser()
-    parser.add_argument('-B','--batch',help='Batch number',type=int,required=True)
-    parser.add_argument('-N','--number',help='Total number of boards (will be labelled from 1 to N)',type=int,required=True)
-    parser.add_argument('-t','--type',help='Board type ([H]ead or [E]dge; [X|V|U|G] layer; subtype [1|2|3|4|5|6])',choices=types.keys(),required=True)
-    args = parser.parse_args()
-    upload(args.batch,args.number,args.type)
+    parser = argparse.ArgumentParser(prog=prog)
+    parser.add_argument('-B','--batch',help='Batch number',type=int)
+    parser.add_argument('-N','--number',help='Total number of boards (will be labelled from 1 to N)',type=int)
+    parser.add_argument('-t','--type',help='Board type ([H]ead or [E]dge; [X|V|U|G] layer; subtype [1|2|3|4|5|6])',choices=types.keys())
+    parser.add_argument('-j','--jobs',help='Number of boards to register concurrently',type=int,default=1)
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--plan',help='Only write what would be registered to this plan file')
+    group.add_argument('--apply',help='Register what a plan file from --plan lists')
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.apply:
+        if args.batch is not None or args.number is not None or args.type is not None:
+            parser.error('-B, -N and -t are taken from the plan file with --apply')
+    elif args.batch is None or args.number is None or args.type is None:
+        parser.error('-B, -N and -t are required')
+    client = connect_from_args(args,pool_size=max(args.jobs,10))
+    if args.plan:
+        batch_plan = plan(args.batch,args.number,args.type,client=client)
+        print_plan(batch_plan,describe)
+        write_plan(args.plan,batch_plan)
+    elif args.apply:
+        apply(args.apply,client=client,jobs=args.jobs)
+    else:
+        upload(args.batch,args.number,args.type,client=client,jobs=args.jobs)
 
 if __name__ == '__main__':
     main()
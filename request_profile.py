@@ -0,0 +1,67 @@
+"""
+Record every HTTP request made through the Sietch client
+(endpoint, status, latency, request/response bytes and retries),
+and report a per-endpoint summary table or json lines.
+"""
+
+import json
+import re
+import sys
+import threading
+
+uuid_pattern = re.compile(r'/api/component/[^/]+$')
+
+def endpoint_name(method, path):
+    return method+' '+uuid_pattern.sub('/api/component/<uuid>',path)
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values)-1,int(q*len(sorted_values)))]
+
+class RequestProfile:
+
+    def __init__(self, json_file=None, summary=True):
+        self.json_file = json_file
+        self.summary = summary
+        self.lock = threading.Lock()
+        self.records = []
+
+    def record(self, method, path, status, latency, request_bytes, response_bytes, retries=0):
+        record = {
+                'endpoint':endpoint_name(method,path),
+                'status':status,
+                'latency':latency,
+                'requestBytes':request_bytes,
+                'responseBytes':response_bytes,
+                'retries':retries,
+                }
+        with self.lock:
+            self.records.append(record)
+
+    def endpoints(self):
+        endpoints = {}
+        with self.lock:
+            for record in self.records:
+                endpoints.setdefault(record['endpoint'],[]).append(record)
+        return endpoints
+
+    def print_summary(self, file=sys.stderr):
+        print(f"{'endpoint':45s} {'count':>6s} {'p50 [s]':>8s} {'p95 [s]':>8s} {'total [s]':>10s} {'sent [kB]':>10s} {'recv [kB]':>10s} {'retries':>8s}",file=file)
+        for endpoint, records in sorted(self.endpoints().items()):
+            latencies = sorted(r['latency'] for r in records)
+            sent = sum(r['requestBytes'] for r in records)/1e3
+            received = sum(r['responseBytes'] for r in records)/1e3
+            retries = sum(r['retries'] for r in records)
+            print(f"{endpoint:45s} {len(records):6d} {percentile(latencies,0.5):8.3f} {percentile(latencies,0.95):8.3f} {sum(latencies):10.3f} {sent:10.1f} {received:10.1f} {retries:8d}",file=file)
+
+    def write_json(self, filename):
+        with self.lock:
+            records = list(self.records)
+        with open(filename,'a') as fl:
+            for record in records:
+                fl.write(json.dumps(record)+'\n')
+
+    def report(self):
+        if self.summary:
+            self.print_summary()
+        if self.json_file:
+            self.write_json(self.json_file)
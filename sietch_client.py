@@ -0,0 +1,244 @@
+"""
+Shared connection to the Sietch database.
+One pooled keep-alive session per process, with the bearer token cached
+and refreshed once if the server rejects it.
+Connection errors and transient server errors are retried with exponential backoff.
+Every request can be recorded in a RequestProfile (see --profile).
+Components are written back with update_component: only the changed data keys
+are sent if the server takes partial updates (partialUpdates in config.dat);
+the GET is skipped when a local copy with a known version (ETag) exists, but only
+if the server is known to refuse stale writes (enforcesIfMatch in config.dat),
+otherwise the copy is revalidated as any other (see --component-ttl).
+Fetched components are kept in an LRU cache (--component-cache-size); entries older
+than --component-ttl seconds are revalidated with If-None-Match / If-Modified-Since.
+Responses are gzip encoded if the server supports it, and large request bodies
+are gzip compressed if compressRequests is set in config.dat.
+"""
+
+import atexit
+import copy
+import gzip
+import json
+import threading
+import time
+
+from component_cache import ComponentCache
+from request_profile import RequestProfile
+from uuid_cache import open_cache
+
+retry_statuses = {429, 500, 502, 503, 504}
+
+# request bodies larger than this are gzip compressed if compress_requests is set
+compress_threshold = 16*1024
+
+class SietchClient:
+
+    def __init__(self, baseurl, auth, pool_size=10, uuid_cache=None, profile=None, max_retries=3, backoff=0.5, partial_updates=False,
+            compress_requests=False, cache_size=256, cache_ttl=0., enforces_if_match=False):
+        # imported here so that scripts start (and print --help) without loading requests
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.baseurl = baseurl
+        self.auth = auth
+        self.uuid_cache = uuid_cache
+        self.profile = profile
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.partial_updates = partial_updates
+        self.compress_requests = compress_requests
+        self.enforces_if_match = enforces_if_match
+        self.components = ComponentCache(cache_size,cache_ttl)
+        self.token = None
+        self.lock = threading.Lock()
+        # number of requests made with request(), retries and authentication not included
+        self.request_count = 0
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1,pool_maxsize=pool_size)
+        self.session.mount('http://',adapter)
+        self.session.mount('https://',adapter)
+        self.session.headers['content-type'] = 'application/json'
+        self.session.headers['accept-encoding'] = 'gzip'
+
+    def record(self, method, path, r, start, retries=0):
+        if self.profile is not None:
+            request_bytes = len(r.request.body or b'')
+            # bytes on the wire, i.e. before decompression
+            response_bytes = int(r.headers.get('content-length',len(r.content)))
+            self.profile.record(method,path,r.status_code,time.perf_counter()-start,request_bytes,response_bytes,retries)
+
+    def send(self, method, path, **kwargs):
+        """
+        returns (response, number of retries)
+        """
+        import requests
+        for attempt in range(self.max_retries+1):
+            try:
+                r = self.session.request(method,self.baseurl+path,**kwargs)
+            except (requests.ConnectionError,requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+            else:
+                if r.status_code not in retry_statuses or attempt == self.max_retries:
+                    return r, attempt
+            time.sleep(self.backoff*2**attempt)
+
+    def authenticate(self):
+        start = time.perf_counter()
+        r, retries = self.send('POST','/machineAuthenticate',json=self.auth)
+        self.record('POST','/machineAuthenticate',r,start,retries)
+        if not r:
+            raise Exception(r.text)
+        self.token = r.text
+        return self.token
+
+    def request(self, method, path, headers={}, allowed_statuses=(), **kwargs):
+        start = time.perf_counter()
+        with self.lock:
+            token = self.token or self.authenticate()
+            self.request_count += 1
+        r, retries = self.send(method,path,headers=dict(headers,authorization='Bearer '+token),**kwargs)
+        if r.status_code == 401:
+            # token expired: re-authenticate once (unless another thread already has)
+            with self.lock:
+                if self.token == token:
+                    self.authenticate()
+                token = self.token
+            r, more_retries = self.send(method,path,headers=dict(headers,authorization='Bearer '+token),**kwargs)
+            retries += 1+more_retries
+        self.record(method,path,r,start,retries)
+        if not r and r.status_code not in allowed_statuses:
+            raise Exception(r.text)
+        return r
+
+    def search(self, component_type, payload):
+        return self.request('POST','/api/search/component/'+component_type,json=payload).json()
+
+    def load_component(self, uuid):
+        """
+        returns (etag, component), from the component cache if the cached copy is
+        younger than the ttl or the server confirms it is unchanged (304)
+        """
+        path = '/api/component/'+uuid
+        entry = self.components.get(uuid)
+        headers = {}
+        if entry is not None:
+            if self.components.is_fresh(entry):
+                return entry.etag, copy.deepcopy(entry.document)
+            if entry.etag is not None:
+                headers['if-none-match'] = entry.etag
+            if entry.last_modified is not None:
+                headers['if-modified-since'] = entry.last_modified
+        r = self.request('GET',path,headers=headers)
+        if r.status_code == 304 and entry is not None:
+            self.components.refresh(entry)
+            return entry.etag, copy.deepcopy(entry.document)
+        component = r.json()
+        etag = r.headers.get('etag')
+        self.components.put(uuid,copy.deepcopy(component),etag,r.headers.get('last-modified'))
+        return etag, component
+
+    def get_component(self, uuid):
+        return self.load_component(uuid)[1]
+
+    def post_component(self, uuid, payload):
+        return self.request('POST','/api/component/'+uuid,json=payload)
+
+    def fetch_for_update(self, uuid):
+        """
+        returns (etag, component reduced to type and data)
+        a cached copy with a known version is used without asking the server if the
+        server refuses writes conditional on a stale version (If-Match), otherwise it is
+        revalidated by load_component
+        """
+        entry = self.components.get(uuid) if self.enforces_if_match else None
+        if entry is not None and entry.etag is not None:
+            etag, payload = entry.etag, copy.deepcopy(entry.document)
+        else:
+            etag, payload = self.load_component(uuid)
+        for k in list(payload):
+            if k != 'type' and k != 'data':
+                payload.pop(k)
+        return etag, payload
+
+    def encode_body(self, body, headers):
+        """
+        json encode a request body, gzip compressing it if it is large and the server accepts that
+        """
+        data = json.dumps(body).encode()
+        if self.compress_requests and len(data) > compress_threshold:
+            data = gzip.compress(data,compresslevel=5)
+            headers['content-encoding'] = 'gzip'
+        return data
+
+    def write_component(self, uuid, payload, changed, etag=None):
+        """
+        write back a payload from fetch_for_update, changed lists the modified data keys
+        returns False (and forgets the cached copy) if etag is no longer current
+        """
+        headers = {} if etag is None else {'if-match':etag}
+        if self.partial_updates:
+            data = self.encode_body({'data':{k:payload['data'][k] for k in changed}},headers)
+            r = self.request('PATCH','/api/component/'+uuid,data=data,headers=headers,allowed_statuses=(412,))
+        else:
+            data = self.encode_body(payload,headers)
+            r = self.request('POST','/api/component/'+uuid,data=data,headers=headers,allowed_statuses=(412,))
+        if r.status_code == 412:
+            self.components.forget(uuid)
+            return False
+        self.components.put(uuid,copy.deepcopy(payload),r.headers.get('etag'),r.headers.get('last-modified'))
+        return True
+
+    def update_component(self, uuid, update):
+        """
+        fetch a component, apply update(payload) and write it back
+        update returns the list of data keys it changed, nothing is written if it is empty
+        a stale local copy is refetched and the update applied again
+        """
+        for attempt in range(2):
+            etag, payload = self.fetch_for_update(uuid)
+            changed = update(payload)
+            if not changed:
+                return False
+            if self.write_component(uuid,payload,changed,etag):
+                return True
+        raise Exception(f"Component {uuid} was modified while it was being updated!")
+
+    def generate_uuid(self):
+        return self.request('GET','/api/generateComponentUuid').json()
+
+    def close(self):
+        self.session.close()
+        if self.uuid_cache is not None:
+            self.uuid_cache.close()
+
+def connect(config_file='config.dat', pool_size=10, use_cache=True, profile=None, max_retries=3, cache_size=256, cache_ttl=0.):
+    with open(config_file) as conf_file:
+        config = json.load(conf_file)
+    uuid_cache = open_cache(config_file,config['url']) if use_cache else None
+    return SietchClient(config['url'],config['auth'],pool_size=pool_size,uuid_cache=uuid_cache,profile=profile,max_retries=max_retries,
+            partial_updates=config.get('partialUpdates',False),compress_requests=config.get('compressRequests',False),
+            cache_size=cache_size,cache_ttl=cache_ttl,enforces_if_match=config.get('enforcesIfMatch',False))
+
+def add_arguments(parser):
+    """
+    command line options shared by every script that talks to the database
+    """
+    parser.add_argument('--no-cache',help='Do not use the local UUID cache',action='store_true')
+    parser.add_argument('--profile',help='Print a timing summary of all requests at exit',action='store_true')
+    parser.add_argument('--profile-json',help='Append one json line per request to this file at exit')
+    parser.add_argument('--retries',help='Number of retries for failed requests (with exponential backoff)',type=int,default=3)
+    parser.add_argument('--component-cache-size',help='Number of components to keep in memory',type=int,default=256)
+    parser.add_argument('--component-ttl',help='Seconds a cached component is used without revalidating it with the server',type=float,default=0.)
+
+# set by apa_daemon.py, commands run by the daemon then share its session and caches
+shared_client = None
+
+def connect_from_args(args, pool_size=10):
+    if shared_client is not None:
+        return shared_client
+    profile = None
+    if args.profile or args.profile_json:
+        profile = RequestProfile(args.profile_json,summary=args.profile)
+        atexit.register(profile.report)
+    return connect(pool_size=pool_size,use_cache=not args.no_cache,profile=profile,max_retries=args.retries,
+            cache_size=args.component_cache_size,cache_ttl=args.component_ttl)
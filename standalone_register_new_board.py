@@ -1,104 +1,85 @@
 #!/usr/bin/env python
 
 """
-usage: standalone_register_new_board.py -B [batch] -b [board] -t [type of board]
+usage: standalone_register_new_board.py -B [batch] -b [board(s)] -t [type of board] (-j [workers])
 Register a new board of boards in the system.
 This batch must already exist.
+Boards may be given as a list/range (e.g. 3,7,12-40), e.g. to retry the boards
+a register_new_batch run failed on: the batch is checked once, the existing boards
+are found with one search, and the new boards are registered concurrently.
+The batch's board type and number of boards are checked from the local cache
+(filled when batches are registered or looked up), the database is only asked on a miss.
 """
 
-import json
-import requests
-import os
+import sys
 
-from board_types import types
-from sietch_config import batch_component_name, board_component_name
+from board_index import find_batch, search_batch
+from board_range import parse_board_range
+from board_types import types, board_type, board_codes
+from register_new_batch import register_boards
+from sietch_client import connect, add_arguments, connect_from_args
+from sietch_config import board_component_name
 
-def upload(batch, board, type_of_board):
+def upload(batch, boards, type_of_board, client=None, jobs=4):
+    """
+    register one board, or a list of boards, in an existing batch
+    """
+    if isinstance(boards,int):
+        boards = [boards]
 
-    with open('config.dat') as conf_file:
-        config = json.load(conf_file)
-        baseurl = config['url']
+    if client is None:
+        client = connect(pool_size=max(jobs,10))
 
-    header = { 'content-type': 'application/json' }
+    batch_uuid, batch_type, number = find_batch(client,batch)
 
-    r = requests.post(baseurl+'/machineAuthenticate',json=config['auth'],headers=header)
-    if not r:
-        raise Exception(r.text)
+    if batch_type != board_type(type_of_board):
+        raise Exception(f"This batch type has been registered as '{batch_type}' ({'/'.join(board_codes(batch_type))}), but you are attempting to register a board of a different type '{board_type(type_of_board)}'")
 
-    token=r.text
+    outside = [board for board in boards if number is not None and not 1 <= board <= number]
+    if len(outside) > 0:
+        raise Exception(f"Batch {batch} has been registered with boards 1 to {number}, boards {outside} are outside that range")
 
-    header['authorization']='Bearer '+token
-
-    payload={
-        'data.batchId':batch,
-        }
-
-    r = requests.post(baseurl+'/api/search/component/'+batch_component_name,json=payload,headers=header)
-
-    if not r:
-        raise Exception(r.text)
-
-    results = r.json()
-
-    if len(results) != 1:
-        raise Exception("This batch has not been registered!")
-
-    batch_uuid = results.pop()['componentUuid']
-
-    r = requests.get(baseurl+'/api/component/'+batch_uuid,headers=header)
-    if not r:
-        raise Exception(r.text)
-
-    batch_type = r.json()['data']['boardType']
-
-    if batch_type != types[type_of_board]:
-        raise Exception(f"This batch type has been registered as '{batch_type}', but you are attempting to register a board of a different type '{types[type_of_board]}'")
-
-    payload={
-        'data.batchId':batch,
-        'data.boardId':board,
-        }
-
-    r = requests.post(baseurl+'/api/search/component/'+board_component_name,json=payload,headers=header)
-
-    if not r:
-        raise Exception(r.text)
-
-    results = r.json()
-
-    if len(results) > 0:
-        raise Exception(f"Batch {batch} board {board} has already been registered!")
-
-    r = requests.get(baseurl+'/api/generateComponentUuid',headers=header)
-    if not r:
-        raise Exception(r.text)
-
-    uuid = r.json()
-    payload = {
-            'type':board_component_name,
-            'data':{
-                'name':f"Batch {batch} board {board}",
-                'batchId':batch,
-                'boardId':board,
-                'boardType':types[type_of_board],
-                'boardStatus':'received'
-                },
+    if len(boards) == 1:
+        # just search for this board rather than the whole batch
+        payload={
+            'data.batchId':batch,
+            'data.boardId':boards[0],
             }
-    r = requests.post(baseurl+'/api/component/'+uuid,json=payload,headers=header)
-    if not r:
-        raise Exception(f"Warning! Failed to register batch {batch} board {board}!!! Please run with standalone registration")
-
-    print(f"Registered batch {batch} board {board}")
-
-
-def main():
+        if len(client.search(board_component_name,payload)) > 0:
+            raise Exception(f"Batch {batch} board {boards[0]} has already been registered!")
+        existing = {}
+    else:
+        existing = search_batch(client,batch)
+
+    failed_registrations = []
+    new_boards = []
+    for board in sorted(set(boards)):
+        if (batch,board) in existing:
+            print(f"Batch {batch} board {board} has already been registered!",file=sys.stderr)
+            failed_registrations.append(board)
+        else:
+            new_boards.append(board)
+
+    failed_boards, latencies, elapsed = register_boards(client,batch,new_boards,type_of_board,None,jobs)
+    for board in new_boards:
+        if board not in failed_boards:
+            print(f"Registered batch {batch} board {board}")
+
+    failed_registrations += failed_boards
+    if len(failed_registrations) > 0:
+        raise Exception(f"Failed to register following board IDs: {sorted(failed_registrations)}")
+
+
+def main(argv=None, prog=None):
     import argparse
-    parser = argparse.ArgumentParser()
+    parser = argparse.ArgumentParser(prog=prog)
     parser.add_argument('-B','--batch',help='Batch number',type=int,required=True)
-    parser.add_argument('-b','--board',help='Board number',type=int,required=True)
+    parser.add_argument('-b','--board',help='Board number, or list/range of board numbers (e.g. 3,7,12-40)',type=parse_board_range,required=True)
     parser.add_argument('-t','--type',help='Board type ([H]ead or [E]dge; [X|V|U|G] layer; subtype [1|2|3|4|5|6])',choices=types.keys(),required=True)
-    args = parser.parse_args()
-    upload(args.batch,args.board,args.type)
+    parser.add_argument('-j','--jobs',help='Number of boards to register concurrently',type=int,default=4)
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    upload(args.batch,args.board,args.type,client=connect_from_args(args,pool_size=max(args.jobs,10)),jobs=args.jobs)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,30 @@
+"""
+Loader for thickness measurement files (one value per line).
+Samples are read straight into a numpy array, blank lines are ignored;
+they are only turned into a list when the payload is built.
+Falls back to plain python lists if numpy is not installed.
+"""
+
+import os
+
+def read_thickness_file(filename):
+    try:
+        import numpy as np
+    except ImportError:
+        with open(filename) as fl:
+            return [float(e) for e in (line.strip() for line in fl) if e]
+    return np.loadtxt(filename,ndmin=1)
+
+def read_thickness_files(filenames):
+    """
+    {label: samples}, the label is the file name without directory and extension
+    """
+    measurements = {}
+    for f in filenames:
+        fn = os.path.basename(f)
+        fn = os.path.splitext(fn)[0]
+        measurements[fn] = read_thickness_file(f)
+    return measurements
+
+def to_list(samples):
+    return samples.tolist() if hasattr(samples,'tolist') else samples
@@ -1,149 +1,269 @@
 #!/usr/bin/env python
 
 """
-usage: upload_position_measurements.py [list of files]
+usage: upload_position_measurements.py (-j [workers]) (--from-start) (--plan [plan file]) [list of files]
+       upload_position_measurements.py --apply [plan file] (-j [workers])
 read position measurement lines from csv files,
 and upload to the database
 will fail if those boards do not exist in the database, or already have position measurements
+board lookups and fetches start while the files are still being parsed,
+nothing is uploaded until every board has been checked
+uploaded boards are recorded in a local journal, so rerunning an interrupted
+upload of the same files skips the boards that were already uploaded
+how far each file has been uploaded is kept in its row index (position_csv.RowIndex),
+so uploading a file again after rows were appended only reads and uploads the new rows
+(unless --from-start is given)
+With --plan, nothing is uploaded: the boards that would be uploaded and the problems
+that would stop the upload are printed, and written with their measurements to a plan file,
+which --apply then uploads without parsing the files or searching for the boards again;
+each board is fetched again, so that what was added to it since the plan was made is kept.
 """
 
 
-import json
-import requests
 import os
-import csv
 import sys
-import datetime
+from concurrent.futures import ThreadPoolExecutor
 
-from sietch_config import board_component_name
-from camelcase import camelcase
+from sietch_client import connect, add_arguments, connect_from_args
+from board_index import BoardResolver
+from checkpoint import open_journal, files_key
+from plan_file import make_plan, write_plan, print_plan, read_plan, mark_applied
+from position_csv import RowIndex, open_index, add_row
 
-def upload(list_of_measurement_files):
+def fetch_board(client, resolver, batch, board):
+    """
+    returns (list of matching uuids, (etag, component payload stripped to type and data))
+    the payload is None unless exactly one board matched
+    """
+    uuids = resolver.lookup(batch,board)
+    if len(uuids) != 1:
+        return uuids, None
 
+    return uuids, client.fetch_for_update(uuids[0])
+
+def post_board(client, journal, batch, board, uuid, payload, etag):
+    if not client.write_component(uuid,payload,['qcPositionMeasurements'],etag):
+        raise Exception(f"Batch {batch} board {board} was modified by someone else during the upload, please try again!")
+    journal.add((batch,board))
+
+def has_position_measurements(payload):
+    key='qcPositionMeasurements'
+    timekey = 'measurementTime'
+    return key in payload['data'] \
+            and len(payload['data'][key])>0 \
+            and timekey in payload['data'][key].keys() \
+            and len(payload['data'][key][timekey]) > 0
+
+def check_rows(rows, client, journal, jobs=1, skip_bad_boards=False):
+    """
+    look up and fetch the boards in rows, an iterable of (batch, board, time string, values),
+    and build their payloads, without writing anything
+    boards already in journal are skipped
+    returns ({(batch, board): {'uuid', 'payload', 'etag'}} of boards to upload, {(batch, board): reason} of bad boards)
+    bad boards are missing or already measured; unless skip_bad_boards, they fail the whole upload
+    """
     measurements = {}
-    header_batch = 'BATCH_ID'
-    header_board = 'BOARD_ID'
-    header_time = 'Measurement time'
-    for f in list_of_measurement_files:
-        headers = []
-        with open(f) as fl:
-            cf = csv.reader(fl)
-            for row in cf:
-                if len(headers) == 0:
-                    headers = row
-                    for pos,h in enumerate(headers):
-                        if h == header_batch: pos_batch = pos
-                        if h == header_board: pos_board = pos
-                        if h == header_time: pos_time = pos
-                elif len(row) > 0: # there could be empty rows
-                    if len(row[pos_batch]) == 0:
-                        # Tolerance rows in csv file
-                        continue
-                    batch = int(row[pos_batch])
-                    board = int(row[pos_board])
-                    time = str(datetime.datetime.strptime(row[pos_time], '%m/%d/%Y %I:%M:%S %p'))
-                    if batch not in measurements.keys():
-                        measurements[batch] = {}
-                    if board not in measurements[batch].keys():
-                        measurements[batch][board] = {'measurements':{ 'measurementTime':time }}
-                    for i in range(len(row)):
-                        h = headers[i]
-                        if ':' in h and h.split(':')[0] in ['1','2']:
-                            hd = h.split(':')[1]
-                            hd_camelcase = camelcase(hd)
-                            measurements[batch][board]['measurements']['position'+hd_camelcase] = float(row[i])
-
-    with open('config.dat') as conf_file:
-        config = json.load(conf_file)
-        baseurl = config['url']
-
-    header = { 'content-type': 'application/json' }
-
-    r = requests.post(baseurl+'/machineAuthenticate',json=config['auth'],headers=header)
-    if not r:
-        raise Exception(r.text)
-
-    token=r.text
-
-    header['authorization']='Bearer '+token
-
-    has_bad_boards = False
-    for batch in measurements:
-        for board in measurements[batch]:
-            search_payload = {
-                    'data.batchId':batch,
-                    'data.boardId':board,
-                    }
-            r = requests.post(baseurl+'/api/search/component/'+board_component_name,json=search_payload,headers=header)
+    fetches = {}
+    with ThreadPoolExecutor(max_workers=jobs) as search_pool, ThreadPoolExecutor(max_workers=jobs) as fetch_pool:
+        resolver = BoardResolver(client,search_pool)
+        try:
+            for batch, board, time, values in rows:
+                if add_row(measurements,batch,board,time,values) and (batch,board) not in journal:
+                    fetches[(batch,board)] = fetch_pool.submit(fetch_board,client,resolver,batch,board)
+            fetched = {key:future.result() for key,future in fetches.items()}
+        except Exception:
+            for future in fetches.values():
+                future.cancel()
+            raise
 
-            if not r:
-                raise Exception(r.text)
+    for batch, board in journal.done:
+        if board in measurements.get(batch,{}):
+            print(f"Skipping batch {batch} board {board}, already uploaded",file=sys.stderr)
+            measurements[batch].pop(board)
 
-            results = r.json()
+    bad_boards = {}
+    for batch in measurements:
+        for board in measurements[batch]:
+            results, payload = fetched[(batch,board)]
 
             if len(results) == 0:
-                #bad_boards.append(batch,board,len(results))
-                has_bad_boards = True
-                print(f"No board found with batch ID {batch} board ID {board}", file=sys.stderr)
+                bad_boards[(batch,board)] = f"No board found with batch ID {batch} board ID {board}"
+                print(bad_boards[(batch,board)], file=sys.stderr)
             elif len(results) > 1:
-                #bad_boards.append(batch,board,len(results))
-                has_bad_boards=True
-                print(f"Multiple boards exist with batch ID {batch} board ID {board}!", file=sys.stderr)
+                bad_boards[(batch,board)] = f"Multiple boards exist with batch ID {batch} board ID {board}!"
+                print(bad_boards[(batch,board)], file=sys.stderr)
             else:
-                r = results.pop()
-                uuid = r['componentUuid']
-                measurements[batch][board]['uuid']=uuid
+                measurements[batch][board]['uuid']=results[0]
 
 
-    if has_bad_boards:
+    if len(bad_boards) > 0 and not skip_bad_boards:
         raise Exception("Bad board configurations found!")
 
+    ready = {}
     for batch in measurements:
         for board in measurements[batch]:
-            uuid = measurements[batch][board]['uuid']
-            r = requests.get(baseurl+'/api/component/'+uuid,headers=header)
-            if not r:
-                raise Exception(r.text)
-
-            payload = r.json()
+            if (batch,board) in bad_boards:
+                continue
+            etag, payload = fetched[(batch,board)][1]
 
-            for k in list(payload):
-                if k != 'type' and k != 'data':
-                    payload.pop(k)
-            
             key='qcPositionMeasurements'
-            timekey = 'measurementTime'
-            if key in payload['data'] \
-                    and len(payload['data'][key])>0 \
-                    and timekey in payload['data'][key].keys() \
-                    and len(payload['data'][key][timekey]) > 0:
-                print(f"Batch {batch} board {board} already has position measurents, not overwriting!",file=sys.stderr)
-                has_bad_boards = True
+            if has_position_measurements(payload):
+                bad_boards[(batch,board)] = f"Batch {batch} board {board} already has position measurents, not overwriting!"
+                print(bad_boards[(batch,board)],file=sys.stderr)
                 continue
-            
+
             payload['data'][key]=measurements[batch][board]['measurements']
-            measurements[batch][board]['payload'] = payload
+            ready[(batch,board)] = {'uuid':measurements[batch][board]['uuid'],'payload':payload,'etag':etag}
 
-    if has_bad_boards:
+    if len(bad_boards) > 0 and not skip_bad_boards:
         raise Exception("Boards with previous measurements found, not overwriting!")
 
-    for batch in measurements:
-        for board in measurements[batch]:
-            uuid = measurements[batch][board]['uuid']
-            payload = measurements[batch][board]['payload']
-            
-            r = requests.post(baseurl+'/api/component/'+uuid,json=payload,headers=header)
-            if not r:
-                raise Exception(r.text)
+    return ready, bad_boards
+
+def post_boards(client, journal, ready, jobs=1):
+    """
+    upload the boards returned by check_rows, returns the list of uploaded (batch, board)
+    """
+    uploaded = []
+    with ThreadPoolExecutor(max_workers=jobs) as post_pool:
+        posts = []
+        for (batch, board), b in ready.items():
+            posts.append((batch,board,post_pool.submit(post_board,client,journal,batch,board,b['uuid'],b['payload'],b['etag'])))
+
+        for batch, board, future in posts:
+            future.result()
+            uploaded.append((batch,board))
             print(f"Uploaded QC position measurements for batch {batch} board {board}")
 
+    return uploaded
+
+def upload_rows(rows, client, journal, jobs=1, skip_bad_boards=False):
+    """
+    upload the boards in rows (see check_rows), uploaded boards are added to journal
+    returns the list of uploaded (batch, board)
+    """
+    ready, bad_boards = check_rows(rows,client,journal,jobs,skip_bad_boards)
+    return post_boards(client,journal,ready,jobs)
+
+def file_rows(indexes, from_start=False):
+    """
+    yield the rows of the files of indexes (RowIndex), from where they were last uploaded unless from_start
+    """
+    for index in indexes:
+        stat = index.validate()
+        start = 0 if from_start else index.uploaded
+        if start > 0:
+            print(f"Reading only the rows appended to {index.filename} since it was last uploaded",file=sys.stderr)
+        count = 0
+        for record in index.rows(start):
+            count += 1
+            yield record
+        if count == 0 and start > 0:
+            print(f"Nothing new to upload in {index.filename} (use --from-start to read it all again)",file=sys.stderr)
+        index.finish(stat)
+
+def upload(list_of_measurement_files, client=None, jobs=1, from_start=False):
+
+    if client is None:
+        client = connect(pool_size=max(2*jobs,10))
+
+    journal = open_journal('upload_positions_'+files_key(list_of_measurement_files))
+
+    indexes = [RowIndex(f) for f in list_of_measurement_files]
+    upload_rows(file_rows(indexes,from_start),client,journal,jobs)
+
+    for index in indexes:
+        index.uploaded = index.end
+        index.save()
+    journal.remove()
+
+def plan(list_of_measurement_files, client=None, jobs=1, from_start=False):
+    """
+    work out what upload would do using read-only requests, returns a plan (see plan_file.py)
+    the plan holds the uuid and the position measurements of every board to upload
+    """
+    if client is None:
+        client = connect(pool_size=max(2*jobs,10))
+
+    lookups = client.request_count
+    journal = open_journal('upload_positions_'+files_key(list_of_measurement_files))
+    indexes = [RowIndex(f) for f in list_of_measurement_files]
+    ready, bad_boards = check_rows(file_rows(indexes,from_start),client,journal,jobs,skip_bad_boards=True)
+    if journal.resumed:
+        journal.close()
+    else:
+        journal.remove()
+
+    actions = [{'action':'upload','batch':batch,'board':board,'uuid':b['uuid'],'measurements':b['payload']['data']['qcPositionMeasurements']}
+            for (batch,board),b in ready.items()]
+    errors = list(bad_boards.values())
+    arguments = {'files':[os.path.abspath(f) for f in list_of_measurement_files],'offsets':[index.end for index in indexes]}
+    # a fetch and a post per board
+    return make_plan('upload-position',client.baseurl,arguments,actions,errors,client.request_count-lookups,2*len(actions))
+
+def describe(action):
+    return f"upload position measurements for batch {action['batch']} board {action['board']} ({action['uuid']})"
+
+def apply(plan_filename, client=None, jobs=1):
+    """
+    upload the measurements of a plan, merged into the current documents of the boards
+    (fetched again, conditionally if they are cached); boards measured since the plan was made fail the upload
+    """
+    if client is None:
+        client = connect(pool_size=max(2*jobs,10))
+
+    plan = read_plan(plan_filename,'upload-position',client.baseurl)
+    files = plan['arguments']['files']
+    journal = open_journal('upload_positions_'+files_key(files))
+    actions = [a for a in plan['actions'] if (a['batch'],a['board']) not in journal]
+
+    with ThreadPoolExecutor(max_workers=jobs) as fetch_pool:
+        current = list(fetch_pool.map(lambda a: client.fetch_for_update(a['uuid']),actions))
+    measured = [a for a, (etag, payload) in zip(actions,current) if has_position_measurements(payload)]
+    if len(measured) > 0:
+        journal.close()
+        raise Exception(f"Boards measured since {plan_filename} was made, not overwriting: "+', '.join(f"batch {a['batch']} board {a['board']}" for a in measured))
+    ready = {}
+    for a, (etag, payload) in zip(actions,current):
+        payload['data']['qcPositionMeasurements'] = a['measurements']
+        ready[(a['batch'],a['board'])] = {'uuid':a['uuid'],'payload':payload,'etag':etag}
+
+    post_boards(client,journal,ready,jobs)
+
+    for f, offset in zip(files,plan['arguments']['offsets']):
+        index = open_index(f)
+        if offset <= index.size:
+            index.uploaded = offset
+            index.save()
+    mark_applied(plan_filename,plan)
+    journal.remove()
+
 
-def main():
+def main(argv=None, prog=None):
     import argparse
-    parser = argparse.ArgumentParser()
-    parser.add_argument('files',help='CSV files to parse',nargs='+')
-    args = parser.parse_args()
-    upload(args.files)
+    parser = argparse.ArgumentParser(prog=prog)
+    parser.add_argument('files',help='CSV files to parse',nargs='*')
+    parser.add_argument('-j','--jobs',help='Number of concurrent requests per stage (lookup, fetch, upload)',type=int,default=1)
+    parser.add_argument('--from-start',help='Read the files from the start, even if they were uploaded before',action='store_true')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--plan',help='Only write what would be uploaded to this plan file')
+    group.add_argument('--apply',help='Upload what a plan file from --plan lists')
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.apply:
+        if len(args.files) > 0:
+            parser.error('the files are taken from the plan file with --apply')
+    elif len(args.files) == 0:
+        parser.error('at least one file is required')
+    client = connect_from_args(args,pool_size=max(2*args.jobs,10))
+    if args.plan:
+        upload_plan = plan(args.files,client=client,jobs=args.jobs,from_start=args.from_start)
+        print_plan(upload_plan,describe)
+        write_plan(args.plan,upload_plan)
+    elif args.apply:
+        apply(args.apply,client=client,jobs=args.jobs)
+    else:
+        upload(args.files,client=client,jobs=args.jobs,from_start=args.from_start)
 
 if __name__ == '__main__':
     main()
@@ -1,103 +1,151 @@
 #!/usr/bin/env python
 
 """
-usage: upload_position_measurements.py -B [batch] -b [board] [list of files]
+usage: upload_thickness_measurements.py -B [batch] -b [board] [list of files]
+       upload_thickness_measurements.py (--dir [directory] | --manifest [file]) (-j [workers])
 read thickness measurements from csv files,
 and upload to the database.
 Will fail if the board doesn't exist in the database.
 Will not overwrite existing measurements.
+With --dir, files are taken from a [directory]/[batch]/[board]/[label].csv tree,
+with --manifest, from a csv file with batchId,boardId,file columns;
+all boards are then resolved in bulk and uploaded concurrently.
 """
 
-import json
-import requests
 import os
+import sys
 
-from sietch_config import board_component_name
+from sietch_client import connect, add_arguments, connect_from_args
+from board_index import find_board, resolve_boards
+from thickness_file import read_thickness_files, to_list
 
-def upload(batch, board, list_of_measurement_files):
-
-    measurements = {}
-    for f in list_of_measurement_files:
-        fn = os.path.basename(f)
-        fn = os.path.splitext(fn)[0]
-        with open(f) as fl:
-            measurements[fn] = [float(e.strip()) for e in fl.readlines()]
-
-    with open('config.dat') as conf_file:
-        config = json.load(conf_file)
-        baseurl = config['url']
-
-    header = { 'content-type': 'application/json' }
-
-    r = requests.post(baseurl+'/machineAuthenticate',json=config['auth'],headers=header)
-    if not r:
-        raise Exception(r.text)
-
-    token=r.text
-
-    header['authorization']='Bearer '+token
-
-    payload={
-        'data.batchId':batch,
-        'data.boardId':board,
-        }
-
-    r = requests.post(baseurl+'/api/search/component/'+board_component_name,json=payload,headers=header)
-
-    if not r:
-        raise Exception(r.text)
-
-    results = r.json()
-
-    if len(results) == 0:
-        raise Exception("No board found with this batch/board number!")
-    if len(results) > 1:
-        raise Exception("Multiple boards exist with this batch/board number!")
-
-    r = results.pop()
-    uuid = r['componentUuid']
-
-    r = requests.get(baseurl+'/api/component/'+uuid,headers=header)
-    if not r:
-        raise Exception(r.text)
-
-    payload = r.json()
-
-    for k in list(payload):
-        if k != 'type' and k != 'data':
-            payload.pop(k)
-    
+def add_measurements(client, batch, board, uuid, measurements):
+    """
+    append measurements to the board's component, skipping labels already in the database
+    """
     key='qcThicknessMeasurements'
-    if key not in payload['data']:
-        payload['data'][key]=[]
-
-    for existing_measurement in payload['data'][key]:
-        name = existing_measurement['measurementLabel']
-        if name in measurements.keys():
-            print(f"WARNING! measurement {name} already in database! will not overwrite!")
-            measurements.pop(name)
-
-    if len(measurements) == 0:
-        print("No data to upload")
-        return
-
-    for m in measurements:
-        payload['data'][key].append({"measurementLabel":m,"measurement":measurements[m]})
-
-    r = requests.post(baseurl+'/api/component/'+uuid,json=payload,headers=header)
-    if not r:
-        raise Exception(r.text)
-    print(f"Uploaded QC thickness measurements for batch {batch} board {board}")
-
 
-def main():
+    def update(payload):
+        if key not in payload['data']:
+            payload['data'][key]=[]
+
+        new_measurements = dict(measurements)
+        for existing_measurement in payload['data'][key]:
+            name = existing_measurement['measurementLabel']
+            if name in new_measurements.keys():
+                print(f"WARNING! measurement {name} already in database for batch {batch} board {board}! will not overwrite!")
+                new_measurements.pop(name)
+
+        if len(new_measurements) == 0:
+            print(f"No data to upload for batch {batch} board {board}")
+            return []
+
+        for m in new_measurements:
+            payload['data'][key].append({"measurementLabel":m,"measurement":to_list(new_measurements[m])})
+        return [key]
+
+    if client.update_component(uuid,update):
+        print(f"Uploaded QC thickness measurements for batch {batch} board {board}")
+
+def add_measurement_files(client, batch, board, uuid, list_of_measurement_files):
+    """
+    read the files and add their measurements, in the worker so only the boards being uploaded are in memory
+    """
+    add_measurements(client,batch,board,uuid,read_thickness_files(list_of_measurement_files))
+
+def upload(batch, board, list_of_measurement_files, client=None):
+
+    measurements = read_thickness_files(list_of_measurement_files)
+
+    if client is None:
+        client = connect()
+
+    uuid = find_board(client,batch,board)
+
+    add_measurements(client,batch,board,uuid,measurements)
+
+def files_from_dir(root):
+    """
+    {(batch, board): [files]} from a root/batch/board/label.csv tree
+    """
+    files = {}
+    for batch in os.listdir(root):
+        if not batch.isdigit() or not os.path.isdir(os.path.join(root,batch)):
+            continue
+        for board in os.listdir(os.path.join(root,batch)):
+            board_dir = os.path.join(root,batch,board)
+            if not board.isdigit() or not os.path.isdir(board_dir):
+                continue
+            csv_files = sorted(os.path.join(board_dir,f) for f in os.listdir(board_dir) if f.endswith('.csv'))
+            if len(csv_files) > 0:
+                files[(int(batch),int(board))] = csv_files
+    return files
+
+def files_from_manifest(filename):
+    """
+    {(batch, board): [files]} from a csv file with batchId,boardId,file columns,
+    file paths are relative to the manifest
+    """
+    import csv
+    files = {}
+    with open(filename) as fl:
+        for row in csv.DictReader(fl):
+            path = os.path.join(os.path.dirname(filename),row['file'])
+            files.setdefault((int(row['batchId']),int(row['boardId'])),[]).append(path)
+    return files
+
+def upload_many(files, client=None, jobs=4):
+    """
+    upload thickness measurements for many boards, files is {(batch, board): [files]}
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if client is None:
+        client = connect(pool_size=max(jobs,10))
+
+    boards = sorted(files)
+    index = resolve_boards(client,boards)
+
+    has_bad_boards = False
+    for batch, board in boards:
+        results = index.get((batch,board),[])
+        if len(results) == 0:
+            has_bad_boards = True
+            print(f"No board found with batch ID {batch} board ID {board}", file=sys.stderr)
+        elif len(results) > 1:
+            has_bad_boards = True
+            print(f"Multiple boards exist with batch ID {batch} board ID {board}!", file=sys.stderr)
+
+    if has_bad_boards:
+        raise Exception("Bad board configurations found!")
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(add_measurement_files,client,batch,board,index[(batch,board)][0],files[(batch,board)]) for batch,board in boards]
+        for future in futures:
+            future.result()
+
+
+def main(argv=None, prog=None):
     import argparse
-    parser = argparse.ArgumentParser()
-    parser.add_argument('-B','--batch',help='Batch number',type=int,required=True)
-    parser.add_argument('-b','--board',help='Board number',type=int,required=True)
-    parser.add_argument('files',help='CSV files to parse',nargs='+')
-    args = parser.parse_args()
-    upload(args.batch,args.board,args.files)
+    parser = argparse.ArgumentParser(prog=prog)
+    parser.add_argument('-B','--batch',help='Batch number',type=int)
+    parser.add_argument('-b','--board',help='Board number',type=int)
+    parser.add_argument('files',help='CSV files to parse',nargs='*')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--dir',help='Directory tree of [batch]/[board]/[label].csv files')
+    group.add_argument('--manifest',help='CSV file with batchId,boardId,file columns')
+    parser.add_argument('-j','--jobs',help='Number of boards to upload concurrently with --dir/--manifest',type=int,default=4)
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.dir or args.manifest:
+        if args.batch is not None or args.board is not None or len(args.files) > 0:
+            parser.error('-B, -b and files cannot be combined with --dir or --manifest')
+        files = files_from_dir(args.dir) if args.dir else files_from_manifest(args.manifest)
+        upload_many(files,client=connect_from_args(args,pool_size=max(args.jobs,10)),jobs=args.jobs)
+    else:
+        if args.batch is None or args.board is None or len(args.files) == 0:
+            parser.error('-B, -b and at least one file are required')
+        upload(args.batch,args.board,args.files,client=connect_from_args(args))
 
 if __name__ == '__main__':
     main()
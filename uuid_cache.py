@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+"""
+usage: uuid_cache.py (--clear | -B [batch] (-b [board]) | --export [file])
+Local persistent cache of board UUIDs, keyed on (batchId, boardId).
+Board UUIDs never change once created, so a cache hit skips the search.
+Batches are cached too, with their board type and number of boards,
+so a single board can be checked against its batch without any request.
+The cache belongs to one database: it records the url it was filled from, and is
+emptied when it is opened for another one.
+Component UUIDs generated but not used (see uuid_pool.py) are kept for the next run.
+Run as a script to invalidate the whole cache, a batch, or a single board,
+or to export it as a batchId,boardId,componentUuid csv manifest for offline labels.
+"""
+
+import os
+import sqlite3
+import threading
+
+cache_file_name = 'uuid_cache.db'
+
+class UuidCache:
+
+    def __init__(self, path=cache_file_name, url=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path,check_same_thread=False,isolation_level=None)
+        self.db.execute('CREATE TABLE IF NOT EXISTS boards (batch INTEGER, board INTEGER, uuid TEXT, PRIMARY KEY (batch, board))')
+        self.db.execute('CREATE TABLE IF NOT EXISTS batches (batch INTEGER PRIMARY KEY, uuid TEXT, board_type TEXT, number INTEGER)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS spare_uuids (uuid TEXT PRIMARY KEY)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        if url is not None and self.url() != url:
+            # filled from another database (or before the url was recorded): none of it applies here
+            self.invalidate()
+            with self.lock:
+                self.db.execute('DELETE FROM spare_uuids')
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES ('url',?)",(url,))
+
+    def url(self):
+        """
+        url of the database the cache was filled from, or None
+        """
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key='url'").fetchone()
+        return row[0] if row else None
+
+    def get(self, batch, board):
+        with self.lock:
+            row = self.db.execute('SELECT uuid FROM boards WHERE batch=? AND board=?',(batch,board)).fetchone()
+        return row[0] if row else None
+
+    def put(self, batch, board, uuid):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO boards VALUES (?,?,?)',(batch,board,uuid))
+
+    def update(self, index):
+        """
+        Store every unambiguous entry of a {(batch, board): [uuid, ...]} index
+        """
+        rows = [(batch,board,uuids[0]) for (batch,board),uuids in index.items() if len(uuids) == 1]
+        with self.lock:
+            self.db.executemany('INSERT OR REPLACE INTO boards VALUES (?,?,?)',rows)
+
+    def get_batch(self, batch):
+        """
+        (uuid, board type, number of boards) of a batch, or None
+        """
+        with self.lock:
+            row = self.db.execute('SELECT uuid, board_type, number FROM batches WHERE batch=?',(batch,)).fetchone()
+        return tuple(row) if row else None
+
+    def put_batch(self, batch, uuid, board_type, number):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO batches VALUES (?,?,?,?)',(batch,uuid,board_type,number))
+
+    def take_spare_uuids(self, count):
+        """
+        remove and return up to count unused component UUIDs
+        """
+        with self.lock:
+            rows = self.db.execute('SELECT uuid FROM spare_uuids LIMIT ?',(count,)).fetchall()
+            self.db.executemany('DELETE FROM spare_uuids WHERE uuid=?',rows)
+        return [row[0] for row in rows]
+
+    def put_spare_uuids(self, uuids):
+        with self.lock:
+            self.db.executemany('INSERT OR IGNORE INTO spare_uuids VALUES (?)',[(uuid,) for uuid in uuids])
+
+    def items(self):
+        """
+        every cached entry as {(batch, board): uuid}
+        """
+        with self.lock:
+            rows = self.db.execute('SELECT batch, board, uuid FROM boards ORDER BY batch, board').fetchall()
+        return {(batch,board):uuid for batch,board,uuid in rows}
+
+    def invalidate(self, batch=None, board=None):
+        with self.lock:
+            if batch is None:
+                self.db.execute('DELETE FROM boards')
+                self.db.execute('DELETE FROM batches')
+            elif board is None:
+                self.db.execute('DELETE FROM boards WHERE batch=?',(batch,))
+                self.db.execute('DELETE FROM batches WHERE batch=?',(batch,))
+            else:
+                self.db.execute('DELETE FROM boards WHERE batch=? AND board=?',(batch,board))
+
+    def close(self):
+        self.db.close()
+
+def open_cache(config_file='config.dat', url=None):
+    """
+    the cache next to config_file, emptied first if url is given and it was filled from another database
+    """
+    return UuidCache(os.path.join(os.path.dirname(config_file),cache_file_name),url)
+
+def export(cache, filename):
+    import csv
+    with open(filename,'w',newline='') as fl:
+        writer = csv.writer(fl)
+        writer.writerow(['batchId','boardId','componentUuid'])
+        for (batch,board),uuid in cache.items().items():
+            writer.writerow([batch,board,uuid])
+
+def main(argv=None, prog=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog=prog)
+    parser.add_argument('--clear',help='Remove every cached UUID',action='store_true')
+    parser.add_argument('-B','--batch',help='Batch number',type=int)
+    parser.add_argument('-b','--board',help='Board number',type=int)
+    parser.add_argument('--export',help='Write the cache to a csv manifest file')
+    args = parser.parse_args(argv)
+    if args.export:
+        export(open_cache(),args.export)
+        return
+    if not args.clear and args.batch is None:
+        parser.error('one of --clear, -B or --export is required')
+    if args.board is not None and args.batch is None:
+        parser.error('-b requires -B')
+    open_cache().invalidate(None if args.clear else args.batch,args.board)
+
+if __name__ == '__main__':
+    main()
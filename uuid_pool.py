@@ -0,0 +1,76 @@
+"""
+Component UUIDs fetched ahead of use from /api/generateComponentUuid by background
+threads, so creating a component does not wait for its UUID.
+At most count UUIDs are fetched (the number the caller will need), and at most
+depth are held at a time; UUIDs left unused (e.g. after an interrupted run) are
+saved in the local UUID cache and handed out first by the next pool.
+"""
+
+import queue
+import threading
+
+class UuidPool:
+
+    def __init__(self, client, count, depth=32, fetchers=4):
+        self.client = client
+        self.lock = threading.Lock()
+        self.spare = client.uuid_cache.take_spare_uuids(count) if client.uuid_cache is not None else []
+        # number of UUIDs still to fetch
+        self.remaining = count-len(self.spare)
+        self.queue = queue.Queue(maxsize=depth)
+        self.stopped = threading.Event()
+        self.threads = [threading.Thread(target=self.fetch,daemon=True) for i in range(min(fetchers,self.remaining))]
+        for thread in self.threads:
+            thread.start()
+
+    def fetch(self):
+        while not self.stopped.is_set():
+            with self.lock:
+                if self.remaining == 0:
+                    return
+                self.remaining -= 1
+            try:
+                uuid = self.client.generate_uuid()
+            except Exception:
+                # get() fetches it itself once the fetchers are gone, and reports the error
+                return
+            while True:
+                if self.stopped.is_set():
+                    with self.lock:
+                        self.spare.append(uuid)
+                    return
+                try:
+                    self.queue.put(uuid,timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+    def get(self):
+        with self.lock:
+            if len(self.spare) > 0:
+                return self.spare.pop()
+        while True:
+            try:
+                return self.queue.get(timeout=0.1)
+            except queue.Empty:
+                if not any(thread.is_alive() for thread in self.threads) and self.queue.empty():
+                    return self.client.generate_uuid()
+
+    def close(self):
+        """
+        stop fetching, and save the UUIDs that were not used
+        """
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join()
+        unused = list(self.spare)
+        while not self.queue.empty():
+            unused.append(self.queue.get_nowait())
+        if len(unused) > 0 and self.client.uuid_cache is not None:
+            self.client.uuid_cache.put_spare_uuids(unused)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+"""
+usage: watch_position_measurements.py [directory] (--pattern [glob]) (-i [seconds]) (-s [seconds]) (-j [workers]) (--once)
+watch a directory for position measurement csv files written by the CMM software,
+and upload the boards in new files, or new rows appended to known files, as they appear
+uses inotify if the inotify_simple package is installed, otherwise polls the directory
+changes are uploaded once the files have been quiet for a few seconds (-s), so a board
+whose rows are still being written is not split in two
+how far every file has been uploaded is kept in its row index (position_csv.RowIndex),
+as by upload_position_measurements.py, so a restarted watcher only parses rows it has not
+uploaded yet, and a file rewritten in place is parsed again from the start
+a last line without its newline is left until it is completed, it may still be being written
+boards that do not exist or already have position measurements are reported and skipped
+"""
+
+import fnmatch
+import os
+import sys
+import time
+
+from sietch_client import connect, add_arguments, connect_from_args
+from checkpoint import open_journal, files_key
+from position_csv import RowIndex
+from upload_position_measurements import upload_rows
+
+def new_rows(directory, pattern, indexes, seen):
+    """
+    parse the complete rows of the matching files past where they were uploaded
+    indexes is {path: RowIndex} kept between calls, seen gets {path: (size, mtime)} of every matching file
+    returns (rows, {path: stat} of the files read, to finish once the rows are uploaded)
+    """
+    rows = []
+    read = {}
+    for entry in sorted(os.scandir(directory),key=lambda e: e.name):
+        if not entry.is_file() or not fnmatch.fnmatch(entry.name,pattern):
+            continue
+        stat = entry.stat()
+        seen[entry.path] = (stat.st_size,stat.st_mtime)
+        if entry.path not in indexes:
+            indexes[entry.path] = RowIndex(entry.path)
+        index = indexes[entry.path]
+        if (stat.st_size,stat.st_mtime) == (index.size,index.mtime) and index.uploaded >= index.offset:
+            continue
+        try:
+            indexed = index.offset
+            stat = index.validate()
+            if indexed > 0 and index.offset == 0:
+                print(f"{entry.path} was rewritten, parsing it again from the start",file=sys.stderr)
+            rows_read = list(index.rows(index.uploaded,final_line=False))
+        except Exception as e:
+            # one bad file must not stop the others: try it again once it changes
+            print(f"Could not parse {entry.path}, skipping it: {e}",file=sys.stderr)
+            indexes.pop(entry.path)
+            continue
+        rows.extend(rows_read)
+        read[entry.path] = stat
+    return rows, read
+
+def process(directory, pattern, indexes, seen, client, journal, jobs):
+    """
+    upload the new rows of the matching files, returns False if the upload failed
+    """
+    rows, read = new_rows(directory,pattern,indexes,seen)
+    if len(rows) > 0:
+        try:
+            upload_rows(rows,client,journal,jobs,skip_bad_boards=True)
+        except Exception as e:
+            # e.g. the database is unreachable: go back to the saved indexes, and try these rows again
+            print(f"Upload failed, will retry: {e}",file=sys.stderr)
+            for path in read:
+                indexes.pop(path)
+            return False
+    for path, stat in read.items():
+        index = indexes[path]
+        index.uploaded = max(index.uploaded,index.end)
+        index.finish(stat)
+    return True
+
+def wait_polling(directory, pattern, seen, interval):
+    """
+    return once a matching file has changed since it was last seen by new_rows
+    """
+    while True:
+        for entry in os.scandir(directory):
+            if entry.is_file() and fnmatch.fnmatch(entry.name,pattern):
+                stat = entry.stat()
+                if seen.get(entry.path) != (stat.st_size,stat.st_mtime):
+                    return
+        time.sleep(interval)
+
+def wait_quiet(directory, pattern, settle):
+    """
+    return once the sizes of the matching files have not changed for settle seconds
+    """
+    sizes = None
+    while True:
+        new_sizes = {e.path:e.stat().st_size for e in os.scandir(directory) if e.is_file() and fnmatch.fnmatch(e.name,pattern)}
+        if new_sizes == sizes:
+            return
+        sizes = new_sizes
+        time.sleep(settle)
+
+def watch(directory, pattern='*.csv', client=None, jobs=4, interval=5., settle=2., once=False):
+    if client is None:
+        client = connect(pool_size=max(2*jobs,10))
+
+    directory = os.path.abspath(directory)
+    indexes = {}
+    seen = {}
+    # uploaded boards, in case the watcher stops between an upload and saving the indexes
+    journal = open_journal('watch_positions_'+files_key([directory]))
+
+    wait_quiet(directory,pattern,settle)
+    uploaded = process(directory,pattern,indexes,seen,client,journal,jobs)
+    if once:
+        return
+
+    try:
+        from inotify_simple import INotify, flags
+    except ImportError:
+        inotify = None
+        print(f"Polling {directory} every {interval} s (install inotify_simple to be notified instead)",file=sys.stderr)
+    else:
+        inotify = INotify()
+        inotify.add_watch(directory,flags.CREATE|flags.MODIFY|flags.CLOSE_WRITE|flags.MOVED_TO)
+        print(f"Watching {directory}",file=sys.stderr)
+
+    while True:
+        if not uploaded:
+            time.sleep(interval)
+        elif inotify is None:
+            wait_polling(directory,pattern,seen,interval)
+            # wait for the files to stop growing
+            time.sleep(settle)
+            wait_quiet(directory,pattern,settle)
+        else:
+            # events on other files, such as the row indexes written next to the csv files, are ignored
+            while not any(fnmatch.fnmatch(event.name,pattern) for event in inotify.read()):
+                pass
+            # wait until there have been no events for settle seconds
+            while any(fnmatch.fnmatch(event.name,pattern) for event in inotify.read(timeout=int(settle*1000))):
+                pass
+        uploaded = process(directory,pattern,indexes,seen,client,journal,jobs)
+
+def main(argv=None, prog=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog=prog)
+    parser.add_argument('directory',help='Directory the CMM software writes csv files to')
+    parser.add_argument('--pattern',help='File name pattern of measurement files',default='*.csv')
+    parser.add_argument('-i','--interval',help='Seconds between directory scans when polling',type=float,default=5.)
+    parser.add_argument('-s','--settle',help='Seconds without changes before new rows are uploaded',type=float,default=2.)
+    parser.add_argument('-j','--jobs',help='Number of concurrent requests per stage (lookup, fetch, upload)',type=int,default=4)
+    parser.add_argument('--once',help='Upload what is new and exit instead of watching',action='store_true')
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    try:
+        watch(args.directory,args.pattern,client=connect_from_args(args,pool_size=max(2*args.jobs,10)),jobs=args.jobs,
+                interval=args.interval,settle=args.settle,once=args.once)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()